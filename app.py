@@ -46,6 +46,8 @@ if code and not st.session_state.get("google_connected"):
         token = exchange_code_for_token(code)
         st.session_state["google_token"] = token
         st.session_state["google_connected"] = True
+        st.session_state.pop("_drive_tree_ids", None)  # nova conta -> nova árvore
+        st.session_state.pop("_drive_service", None)
         # Limpa parâmetros para não repetir
         try:
             st.query_params.clear()
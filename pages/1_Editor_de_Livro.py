@@ -2,24 +2,24 @@
 from __future__ import annotations
 
 import os
-import io
-import zipfile
-import tempfile
+import re
+import hashlib
 from datetime import datetime
-from typing import Optional, List, TYPE_CHECKING, Any
 
 import streamlit as st
-from unidecode import unidecode
 
 from src.storage.drive import (
-    drive_service_from_token,
+    drive_service_for_session,
     list_files_md,
-    download_text,
+    list_files_md_cached,
+    download_text_cached,
+    download_many,
+    clear_listing_cache,
     upload_text,
     upload_binary,
 )
 from src.knowledge.repo import (
-    ensure_user_tree,
+    ensure_user_tree_cached,
     TRANSCRICAO_DIR,
     VERSOES_DIR,
     VECSTORE_DIR,
@@ -27,72 +27,19 @@ from src.knowledge.repo import (
 )
 from src.embeddings.vectorstore_faiss import (
     create_faiss_index,
-    save_faiss_index,
+    faiss_index_to_zip_bytes,
 )
-
-# ===== LLM (BYOK) =====
-try:
-    from langchain_openai import ChatOpenAI as _ChatOpenAI  # runtime
-except Exception:
-    _ChatOpenAI = None  # type: ignore
-
-if TYPE_CHECKING:
-    from langchain_openai import ChatOpenAI  # só para type hints
-else:
-    ChatOpenAI = Any  # type: ignore[misc,assignment]
-
+from src.llm.editor import stream_book_edit_cached
+from src.utils.text import first_line_slug
 
 # =============== Utils ===============
-def _zip_dir_to_bytes(path: str) -> bytes:
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(path):
-            for name in files:
-                full = os.path.join(root, name)
-                rel = os.path.relpath(full, path)
-                zf.write(full, rel)
-    return buf.getvalue()
-
-
-def _first_line_slug(text: str, fallback: str = "versao") -> str:
-    base = (text or "").strip().split("\n", 1)[0]
-    base = unidecode(base).lower()
-    keep = []
-    for ch in base:
-        if ch.isalnum() or ch in (" ", "-", "_", "."):
-            keep.append(ch)
-    slug = "".join(keep).strip().replace(" ", "_")
-    slug = slug or fallback
-    return slug[:60]
-
-
-def _get_llm() -> Optional[ChatOpenAI]:
-    if not st.session_state.get("OPENAI_API_KEY"):
-        return None
-    if _ChatOpenAI is None:
-        return None
-    os.environ["OPENAI_API_KEY"] = st.session_state["OPENAI_API_KEY"]
-    return _ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0.2,
-        streaming=True,
-        openai_api_key=st.session_state["OPENAI_API_KEY"],
-    )
-
-
-def _format_for_book(llm: ChatOpenAI, raw_text: str, style_prompt: str) -> str:
-    sys = (
-        "Você é um **editor de livros tradicional**. Seu trabalho é **corrigir gramática, clareza, coesão** "
-        "e **formatar** o texto para um livro, mantendo a **voz do autor** e **sem inventar fatos**. "
-        "Quando houver ambiguidade, prefira a versão mais natural em Português do Brasil."
-    )
-    usr = f"Estilo/audiência/instruções do autor:\n{style_prompt}\n\nTexto original:\n{raw_text}"
-    messages = [{"role": "system", "content": sys}, {"role": "user", "content": usr}]
-
-    acc = ""
-    for chunk in llm.stream(messages):
-        acc += (chunk.content or "")
-    return acc
+def _versions_of(files: list, base_title: str) -> list:
+    """
+    Versões do mesmo título: "{slug}_{ts}.txt" ou "{slug}_v{n}_{ts}.txt" (ordem da listagem).
+    Nome exato: "cap_1" não pega as versões de "cap_10".
+    """
+    pat = re.compile(rf"{re.escape(base_title)}(?:_v\d+)?_\d{{8}}_\d{{6}}\.txt")
+    return [f for f in files if pat.fullmatch(f["name"])]
 
 
 # =============== Página ===============
@@ -108,8 +55,8 @@ if not st.session_state.get("google_connected") or not st.session_state.get("goo
     st.warning("Conecte o **Google Drive** em **Conexões** para usar o Editor.")
     st.stop()
 
-service = drive_service_from_token(st.session_state["google_token"])
-ids = ensure_user_tree(service)
+service = drive_service_for_session(st.session_state["google_token"])
+ids = ensure_user_tree_cached(service)
 trans_id = ids["trans"]
 versions_id = ids["versions"]
 vec_id = ids["vec"]
@@ -126,12 +73,24 @@ with colA:
     origem = st.radio("Origem", ["Transcrições", "Versões"], horizontal=True)
     folder_id = trans_id if origem == "Transcrições" else versions_id
 
-    files = list_files_md(service, folder_id, extensions=[".txt"])
+    files = list_files_md_cached(service, folder_id, extensions=[".txt"])
     options = [f["name"] for f in files] if files else []
-    sel = st.selectbox("Arquivo", options, index=0 if options else None, placeholder="Escolha...")
+    sel = st.multiselect(
+        "Arquivos",
+        options,
+        default=options[:1],
+        placeholder="Escolha um ou mais (na ordem em que devem entrar no texto)...",
+    )
     if sel and st.button("Carregar no editor", use_container_width=True):
-        file_id = next(f["id"] for f in files if f["name"] == sel)
-        content = download_text(service, file_id)
+        by_name = {f["name"]: f for f in files}
+        metas = [by_name[n] for n in sel]
+        if len(metas) == 1:
+            content = download_text_cached(service, metas[0]["id"], metas[0].get("modifiedTime"))
+        else:
+            # várias partes (p.ex. transcrições de um mesmo capítulo): baixadas em paralelo,
+            # juntadas na ordem escolhida
+            parts = download_many(st.session_state["google_token"], [m["id"] for m in metas])
+            content = "\n\n".join(p.strip() for p in parts)
         st.session_state["_pending_new_text"] = content
         st.rerun()
 
@@ -158,13 +117,20 @@ texto_atual = st.text_area(
 col1, col2 = st.columns(2)
 with col1:
     if st.button("✨ Gerar nova versão a partir do texto atual", use_container_width=True):
-        llm = _get_llm()
-        if llm is None:
-            st.error("LLM indisponível. Verifique sua OPENAI_API_KEY.")
-            st.stop()
-        with st.spinner("Editando com o agente…"):
-            novo = _format_for_book(llm, texto_atual, st.session_state.get("editor_instrucoes", ""))
-        st.session_state["_pending_new_text"] = novo
+        # o texto aparece enquanto é gerado; write_stream devolve o texto completo no fim.
+        # Mesmo texto + mesmas instruções: vem do cache em disco, sem nova chamada ao modelo
+        novo = st.write_stream(
+            stream_book_edit_cached(
+                st.session_state["OPENAI_API_KEY"],
+                texto_atual,
+                audience=None,
+                tone=None,
+                language="PT-BR",
+                notes=None,
+                instructions=st.session_state.get("editor_instrucoes", ""),
+            )
+        )
+        st.session_state["_pending_new_text"] = (novo or "").strip()
         st.success("Nova versão gerada. Atualizando editor…")
         st.rerun()
 
@@ -174,22 +140,33 @@ with col2:
             st.warning("Não há texto para salvar.")
             st.stop()
 
-        base_title = _first_line_slug(texto_atual, "versao")
+        base_title = first_line_slug(texto_atual, "versao")
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         fname_text = build_version_filename(base_title, suffix=None)
-        existing = [f["name"] for f in list_files_md(service, versions_id, extensions=[".txt"])]
-        same_base = [n for n in existing if n.startswith(base_title)]
+        existing = list_files_md(service, versions_id, extensions=[".txt"])
+
+        # Texto idêntico à última versão **deste título** (listagem vem por modifiedTime desc):
+        # não regrava o .txt nem re-indexa. Voltar a um texto mais antigo gera versão nova.
+        same_base = _versions_of(existing, base_title)
+        content_hash = hashlib.blake2b(texto_atual.encode("utf-8"), digest_size=8).hexdigest()
+        latest = same_base[0] if same_base else None
+        if latest and (latest.get("appProperties") or {}).get("content_hash") == content_hash:
+            st.info(f"Este texto é idêntico à última versão, **{latest['name']}** — nada a salvar.")
+            st.stop()
+
         if same_base:
             fname_text = f"{base_title}_v{len(same_base)+1}_{ts}.txt"
 
         with st.spinner("Salvando versão em texto…"):
-            _ = upload_text(service, versions_id, fname_text, texto_atual)
+            _ = upload_text(
+                service, versions_id, fname_text, texto_atual,
+                app_properties={"content_hash": content_hash},
+            )
+        clear_listing_cache()
 
         with st.spinner("Indexando esta versão no Vecstore…"):
             index = create_faiss_index([texto_atual])
-            with tempfile.TemporaryDirectory() as td:
-                save_faiss_index(index, td)
-                data = _zip_dir_to_bytes(td)
+            data = faiss_index_to_zip_bytes(index)
             faiss_name = f"{os.path.splitext(fname_text)[0]}.faiss.zip"
             upload_binary(service, vec_id, faiss_name, data, mimetype="application/zip")
 
@@ -3,55 +3,31 @@ from __future__ import annotations
 
 import os
 import io
-import zipfile
-import tempfile
-from datetime import datetime
+import shutil
 from typing import List
 
 import streamlit as st
-from unidecode import unidecode
 from pypdf import PdfReader
 
 from src.storage.drive import (
-    drive_service_from_token,
+    drive_service_for_session,
     upload_text,
-    upload_binary,
     list_files_md,
+    clear_listing_cache,
 )
 from src.knowledge.repo import (
-    ensure_user_tree,
+    ensure_user_tree_cached,
     TRANSCRICAO_DIR,
     VERSOES_DIR,      # mantido (áudio bruto não muda o fluxo)
     VECSTORE_DIR,
     REFERENCIAS_DIR,  # <<< NOVO
     build_version_filename,
+    save_new_versions_bulk,
 )
-from src.embeddings.vectorstore_faiss import (
-    create_faiss_index,
-    save_faiss_index,
-)
+from src.pipelines.transcribe import WHISPER_SAFE_BYTES, transcribe_audio_cached
+from src.utils.text import first_line_slug
 
 # ---------- Utils ----------
-def _zip_dir_to_bytes(path: str) -> bytes:
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(path):
-            for name in files:
-                full = os.path.join(root, name)
-                rel = os.path.relpath(full, path)
-                zf.write(full, rel)
-    return buf.getvalue()
-
-def _first_line_slug(text: str, fallback: str = "documento") -> str:
-    base = (text or "").strip().split("\n", 1)[0] or fallback
-    base = unidecode(base).lower()
-    keep = []
-    for ch in base:
-        if ch.isalnum() or ch in (" ", "-", "_", "."):
-            keep.append(ch)
-    slug = "".join(keep).strip().replace(" ", "_")
-    return slug[:60] or fallback
-
 def _extract_pdf_text(file_bytes: bytes) -> str:
     """Extrai texto de um PDF. (Para PDFs escaneados sem OCR, pode retornar vazio.)"""
     reader = PdfReader(io.BytesIO(file_bytes))
@@ -73,8 +49,8 @@ if not st.session_state.get("google_connected") or not st.session_state.get("goo
     st.warning("Conecte o **Google Drive** em **Conexões** para usar esta página.")
     st.stop()
 
-service = drive_service_from_token(st.session_state["google_token"])
-ids = ensure_user_tree(service)
+service = drive_service_for_session(st.session_state["google_token"])
+ids = ensure_user_tree_cached(service)
 trans_id = ids["trans"]       # Transcrições brutas (áudio -> texto)
 versions_id = ids["versions"] # (mantido, mas não usaremos para PDFs)
 vec_id = ids["vec"]           # Vecstore (.faiss.zip)
@@ -103,35 +79,55 @@ with st.expander("🎧 Transcrever áudio (salva **só** em Transcrições)", ex
             index=0,
             help="Mantendo o comportamento atual (BYOK)."
         )
+        long_audio = st.checkbox(
+            "Áudio longo: dividir em janelas de 30 s e transcrever em paralelo",
+            value=audio is not None and audio.size > WHISPER_SAFE_BYTES,
+            help="Bem mais rápido para gravações longas; precisa de ffmpeg no servidor.",
+        )
 
     if st.button("Transcrever", use_container_width=True, type="primary", disabled=audio is None):
         if audio is None:
             st.warning("Envie um arquivo de áudio.")
             st.stop()
 
-        # Checagem de tamanho para o endpoint (≈25 MB)
-        size_mb = len(audio.getvalue()) / (1024 * 1024)
-        if size_mb > 25:
-            st.error(
-                f"Arquivo com {size_mb:.1f} MB. O endpoint de transcrição aceita até 25 MB por arquivo. "
-                "Comprima ou divida em partes menores."
-            )
+        openai_key = st.session_state.get("OPENAI_API_KEY")
+        if not openai_key:
+            st.warning("Cole sua **OPENAI_API_KEY** em **Conexões** para transcrever.")
             st.stop()
 
-        # >>> Substitua pelo seu fluxo real de transcrição (BYOK) <<<
+        # O endpoint aceita até ≈25 MB por arquivo: acima disso o áudio é reduzido/dividido via ffmpeg
+        data = audio.getvalue()
+        if not shutil.which("ffmpeg"):
+            if len(data) > WHISPER_SAFE_BYTES:
+                st.error(
+                    f"Arquivo com {len(data) / (1024 * 1024):.1f} MB e sem ffmpeg no servidor para reduzir/dividir. "
+                    "O endpoint de transcrição aceita até 25 MB por arquivo: comprima ou divida em partes menores."
+                )
+                st.stop()
+            long_audio = False  # sem ffmpeg não há como dividir: vai numa chamada só
+
         with st.spinner("Transcrevendo áudio..."):
-            transcricao = f"[Transcrição simulada de {audio.name} — substitua pela chamada real]"
-        # -----------------------------------------------------------
+            try:
+                # cache em disco pelo conteúdo: reenviar o mesmo áudio não volta ao Whisper
+                transcricao, _ = transcribe_audio_cached(data, audio.name, openai_key, long=long_audio)
+            except Exception as e:
+                st.error(f"Falha na transcrição: {e}")
+                st.stop()
+
+        if not transcricao.strip():
+            st.warning("A transcrição voltou vazia (áudio sem fala?). Nada foi salvo.")
+            st.stop()
 
         # Nome e salvamento em Transcrições (sem embeddings)
         if audio_title.strip():
-            base = _first_line_slug(audio_title)
+            base = first_line_slug(audio_title)
         else:
             base = os.path.splitext(os.path.basename(audio.name))[0]
-            base = _first_line_slug(base or "transcricao")
+            base = first_line_slug(base or "transcricao")
 
         fname = build_version_filename(base, suffix=None).replace(".txt", "_transcricao.txt")
         upload_text(service, trans_id, fname, transcricao)
+        clear_listing_cache()
         st.success(f"Transcrição salva em **{TRANSCRICAO_DIR}** como **{fname}**.")
         st.info("Para indexar no acervo/vecstore, use o **Editor** e salve como nova versão.")
 
@@ -151,39 +147,33 @@ pdfs = st.file_uploader(
 if pdfs:
     st.caption("Dica: para PDFs escaneados (imagem), use OCR; sem OCR, o texto pode sair vazio.")
     if st.button("Processar PDFs", use_container_width=True, type="primary"):
+        items, sources = [], []
         for pdf in pdfs:
             with st.spinner(f"Extraindo texto de **{pdf.name}**..."):
-                data = pdf.getvalue()
-                text = _extract_pdf_text(data)
+                text = _extract_pdf_text(pdf.getvalue())
 
             if not text.strip():
                 st.warning(f"Não foi possível extrair texto de **{pdf.name}** (PDF pode ser escaneado sem OCR). Pulando.")
                 continue
 
             # Nome base pelo 1º título (ou nome do PDF)
-            base_title = _first_line_slug(text, fallback=os.path.splitext(pdf.name)[0])
+            items.append({"title": first_line_slug(text, fallback=os.path.splitext(pdf.name)[0]), "text": text})
+            sources.append(pdf.name)
+
+        if items:
             existing = [f["name"] for f in list_files_md(service, refs_id, extensions=[".txt"])]
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            fname_txt = build_version_filename(base_title, suffix=None)
-            if fname_txt in existing:
-                # Evita colisão de nomes
-                fname_txt = f"{base_title}_v{len([n for n in existing if n.startswith(base_title)])+1}_{ts}.txt"
-
-            # 1) Salva o texto extraído em **Referencias**
-            upload_text(service, refs_id, fname_txt, text)
-
-            # 2) Gera embeddings e salva pacote no **Vecstore**
-            with st.spinner("Indexando no Vecstore…"):
-                index = create_faiss_index([text])
-                with tempfile.TemporaryDirectory() as td:
-                    save_faiss_index(index, td)
-                    data_zip = _zip_dir_to_bytes(td)
+            # .txt em **Referencias** sobem em paralelo enquanto os embeddings de todos são calculados;
+            # depois, um pacote .faiss.zip por texto no **Vecstore**
+            with st.spinner(f"Salvando e indexando {len(items)} texto(s) no Vecstore…"):
+                saved = save_new_versions_bulk(
+                    st.session_state["google_token"], refs_id, items,
+                    vec_folder_id=vec_id, existing_names=existing,
+                )
+            clear_listing_cache()
+
+            for src_name, (_, fname_txt) in zip(sources, saved):
                 faiss_name = f"{os.path.splitext(fname_txt)[0]}.faiss.zip"
-                upload_binary(service, vec_id, faiss_name, data_zip, mimetype="application/zip")
-
-            st.success(
-                f"**{pdf.name}** → salvo como **{fname_txt}** em **{REFERENCIAS_DIR}** "
-                f"e indexado como **{faiss_name}** em **{VECSTORE_DIR}**."
-            )
-
-
+                st.success(
+                    f"**{src_name}** → salvo como **{fname_txt}** em **{REFERENCIAS_DIR}** "
+                    f"e indexado como **{faiss_name}** em **{VECSTORE_DIR}**."
+                )
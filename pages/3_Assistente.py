@@ -2,18 +2,22 @@
 from __future__ import annotations
 
 import os
-import io
 import time
 import json
-import zipfile
+import hashlib
+import logging
+import shutil
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Optional, TYPE_CHECKING, Any
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING, Any
 
 import streamlit as st
 
 from src.storage.drive import (
     drive_service_from_token,
+    drive_service_for_session,
     list_files_md,
     list_files_in_folder,
     download_binary,
@@ -23,16 +27,26 @@ from src.storage.drive import (
     update_file_contents,
     find_or_create_folder,
     ensure_subfolder,
+    thread_service_getter,
 )
-from src.knowledge.repo import ensure_user_tree, VECSTORE_DIR
+from src.knowledge.repo import ensure_user_tree_cached, VECSTORE_DIR
+from src.llm.tokens import truncate_tokens
 
 # Embeddings / FAISS
 from src.embeddings.vectorstore_faiss import (
-    load_faiss_index,
+    load_faiss_index_mmap,
+    compact_faiss_index,
+    embed_query_cached,
+    load_faiss_index_from_tar_bytes,
+    load_faiss_index_from_zip_bytes,
+    faiss_index_to_tar_bytes,
     create_faiss_index,
     save_faiss_index,
+    faiss_index_to_zip_bytes,
 )
 
+logger = logging.getLogger(__name__)
+
 # ===== LLM (BYOK) =====
 try:
     from langchain_openai import ChatOpenAI as _ChatOpenAI  # runtime
@@ -50,58 +64,304 @@ try:
 except Exception:
     DDGS = None  # type: ignore
 
+# ===== JSON rápido opcional (orjson) =====
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
 
 CHAT_DIR = "Chats"  # pasta dedicada para memória de chat no Drive
 
+# Índice global mesclado (pacotes do Editor/Referências), para não refazer o merge N-way a cada cold start
+SNAPSHOT_NAME = "_snapshot.faiss.zip"
+CHAT_PKG_PREFIX = "chat-"  # pacotes de chat mudam a cada turno: ficam fora do snapshot
+PKG_SUFFIXES = (".faiss.zip", ".faiss.tar")  # .tar = serialização em memória (chat); .zip = legado/Editor
+
+# Cache local dos pacotes baixados (por fileId + modifiedTime) e dos merges já feitos
+FAISS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "faiss_cache")
+FAISS_CACHE_MAX = 256
+FAISS_MERGED_MAX = 4
+IO_POLL_SECONDS = 2  # reexecução do fragmento do badge "salvando..." (escritas em segundo plano)
+DOWNLOAD_WORKERS = 8  # downloads paralelos de pacotes da Vecstore
+
+# Limites do contexto enviado ao LLM no RAG
+CTX_BLOCK_MAX_TOKENS = 512    # corte por trecho (= tamanho do chunk do splitter)
+CTX_TOTAL_MAX_TOKENS = 3000   # orçamento total de contexto
+
+# Memo por sessão das últimas buscas (pergunta, k) -> docs, válido para o store atual
+RETRIEVAL_CACHE_MAX = 64
+
+# Streaming: agrupa tokens antes de re-renderizar o markdown (menos reflows/mensagens WS)
+STREAM_FLUSH_SECONDS = 0.04
+STREAM_FLUSH_CHARS = 80
+
 
 # ==========================
 # Helpers de Drive / FAISS
 # ==========================
-def _unzip_bytes_to_tempdir(data: bytes) -> str:
-    td = tempfile.mkdtemp(prefix="faiss_")
-    with zipfile.ZipFile(io.BytesIO(data), "r") as zf:
-        zf.extractall(td)
-    return td
+def _list_vec_and_chats(
+    token: Dict[str, Any],
+    vec_id: Optional[str],
+    chats_id: Optional[str],
+) -> Tuple[Optional[List[dict]], Optional[List[dict]]]:
+    """
+    Lista Vecstore (.zip/.tar) e Chats (.txt) em paralelo (None para pastas não pedidas).
+    Cada thread usa seu próprio service: o httplib2 por trás do client não é thread-safe.
+    """
+    def _list(folder_id: Optional[str], exts: List[str]) -> Optional[List[dict]]:
+        if not folder_id:
+            return None
+        return list_files_md(drive_service_from_token(token), folder_id, extensions=exts)
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_vec = ex.submit(_list, vec_id, [".zip", ".tar"])
+        f_chats = ex.submit(_list, chats_id, [".txt"])
+        return f_vec.result(), f_chats.result()
 
 
-def _zip_dir_to_bytes(path: str) -> bytes:
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(path):
-            for name in files:
-                full = os.path.join(root, name)
-                rel = os.path.relpath(full, path)
-                zf.write(full, rel)
-    return buf.getvalue()
+def _snapshot_key(files: List[dict]) -> str:
+    """Assinatura do conjunto de pacotes contido no snapshot (cabe em appProperties)."""
+    return hashlib.sha1(",".join(sorted(f["id"] for f in files)).encode("utf-8")).hexdigest()
 
 
-def _load_global_index_from_drive(service) -> Optional[object]:
+def _cache_entry_dir(fmeta: dict) -> str:
+    mtime = "".join(ch for ch in fmeta.get("modifiedTime", "") if ch.isalnum())
+    return os.path.join(FAISS_CACHE_DIR, f"{fmeta['id']}_{mtime}")
+
+
+def _prune_pkg_cache(keep_id: str, keep_dir: str) -> None:
+    """Remove versões antigas do mesmo arquivo e mantém só as FAISS_CACHE_MAX entradas mais recentes (LRU)."""
+    try:
+        entries = [
+            e for e in os.scandir(FAISS_CACHE_DIR)
+            if e.is_dir() and not e.name.startswith(("merged_", "tmp_"))
+        ]
+    except FileNotFoundError:
+        return
+    for e in entries:
+        if e.name.startswith(f"{keep_id}_") and e.path != keep_dir:
+            shutil.rmtree(e.path, ignore_errors=True)
+    entries = [e for e in entries if os.path.isdir(e.path)]
+    if len(entries) > FAISS_CACHE_MAX:
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for e in entries[: len(entries) - FAISS_CACHE_MAX]:
+            shutil.rmtree(e.path, ignore_errors=True)
+
+
+def _load_package_bytes(name: str, data: bytes):
+    # index.faiss/index.pkl lidos direto dos bytes do pacote, sem extrair para disco
+    if name.lower().endswith(".faiss.tar"):
+        return load_faiss_index_from_tar_bytes(data)
+    return load_faiss_index_from_zip_bytes(data)
+
+
+def _load_cached_dir(path: str):
+    with os.scandir(path) as it:
+        entry = next(e for e in it if e.name.startswith("package."))
+    with open(entry.path, "rb") as f:
+        return _load_package_bytes(entry.name, f.read())
+
+
+def _load_package(service, fmeta: dict):
+    """Carrega um pacote da Vecstore, usando o cache local por (fileId, modifiedTime) quando possível."""
+    entry = _cache_entry_dir(fmeta)
+    if os.path.isdir(entry):
+        try:
+            store = _load_cached_dir(entry)
+            os.utime(entry)  # marca uso recente (LRU)
+            return store
+        except Exception:
+            shutil.rmtree(entry, ignore_errors=True)  # entrada inválida: baixa de novo
+
+    data = download_binary(service, fmeta["id"])
+    store = _load_package_bytes(fmeta["name"], data)
+    os.makedirs(FAISS_CACHE_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix="tmp_", dir=FAISS_CACHE_DIR)
+    ext = ".faiss.tar" if fmeta["name"].lower().endswith(".faiss.tar") else ".faiss.zip"
+    with open(os.path.join(tmp, f"package{ext}"), "wb") as f:
+        f.write(data)
+    try:
+        os.rename(tmp, entry)  # atômico; se outra sessão chegou antes, usa a dela
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    _prune_pkg_cache(fmeta["id"], entry)
+    return store
+
+
+def _load_packages_parallel(token: Dict[str, Any], metas: List[dict]) -> Iterator[Tuple[dict, object]]:
     """
-    Baixa todos os pacotes *.faiss.zip da pasta Vecstore e mescla num único índice.
-    Inclui os pacotes gerados pelo Editor e também os pacotes de chat.
+    Baixa/carrega pacotes em paralelo e devolve (fmeta, store) conforme ficam prontos (o merge
+    fica na thread chamadora). Um service por worker: o httplib2 do client não é thread-safe.
+    Pacotes que falham são registrados no log e ficam de fora.
     """
-    ids = ensure_user_tree(service)
-    vec_id = ids["vec"]
+    if not metas:
+        return
+    get_service = thread_service_getter(token)
+
+    def _work(fmeta: dict):
+        return _load_package(get_service(), fmeta)
 
-    zips = [f for f in list_files_md(service, vec_id, extensions=[".zip"]) if f["name"].lower().endswith(".faiss.zip")]
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(metas))) as ex:
+        futs = {ex.submit(_work, f): f for f in metas}
+        for fut in as_completed(futs):
+            fmeta = futs[fut]
+            try:
+                store = fut.result()
+            except Exception:
+                logger.warning("Pacote %s ignorado: falha ao carregar", fmeta.get("name"), exc_info=True)
+                continue
+            yield fmeta, store
+
+
+def _merge_into(base_store, store, name: str = "") -> Tuple[object, bool]:
+    """Mescla `store` em `base_store`; devolve (store resultante, se o merge deu certo)."""
+    if base_store is None:
+        return store, True
+    try:
+        base_store.merge_from(store)
+    except Exception:
+        logger.warning("Pacote %s ignorado: falha no merge", name, exc_info=True)
+        return base_store, False
+    return base_store, True
+
+
+def _save_snapshot(service, vec_id: str, existing: Optional[dict], store, key: str) -> None:
+    data = faiss_index_to_zip_bytes(store)
+    props = {"snapshot_of": key}
+    if existing:
+        update_file_contents(service, existing["id"], data, mimetype="application/zip", app_properties=props)
+    else:
+        upload_binary(service, vec_id, SNAPSHOT_NAME, data, mimetype="application/zip", app_properties=props)
+
+
+def _vec_packages(vec_files: List[dict]) -> Tuple[Optional[dict], List[dict]]:
+    """Separa (snapshot, pacotes válidos) da listagem da Vecstore."""
+    snapshot = next((f for f in vec_files if f["name"] == SNAPSHOT_NAME), None)
+    names = {f["name"] for f in vec_files}
+    zips = [
+        f for f in vec_files
+        if f["name"].lower().endswith(PKG_SUFFIXES) and f["name"] != SNAPSHOT_NAME
+        # chat-<id>.faiss.zip antigo fica obsoleto quando já existe o .faiss.tar do mesmo chat
+        and not (f["name"].endswith(".faiss.zip") and f["name"][:-4] + ".tar" in names)
+    ]
+    return snapshot, zips
+
+
+def _listing_signature(zips: List[dict]) -> str:
+    sig = sorted((f["id"], f.get("modifiedTime", ""), str(f.get("size", ""))) for f in zips)
+    if orjson is not None:
+        raw = orjson.dumps(sig)  # já sai em bytes UTF-8
+    else:
+        raw = json.dumps(sig, separators=(",", ":")).encode("utf-8")  # mesmo formato compacto
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _load_global_index_from_drive(service, vec_files: Optional[List[dict]] = None) -> Optional[object]:
+    """
+    Baixa todos os pacotes *.faiss.zip / *.faiss.tar da pasta Vecstore e mescla num único índice.
+    Inclui os pacotes gerados pelo Editor e também os pacotes de chat.
+    `vec_files`: listagem já obtida da Vecstore (evita listar de novo).
+
+    O resultado fica em cache pela assinatura (id, modifiedTime, size) dos pacotes: em memória
+    (entre reruns/sessões) e em disco; só pacotes alterados são baixados de novo.
+    """
+    vec_id = ensure_user_tree_cached(service)["vec"]
+    if vec_files is None:
+        vec_files = list_files_md(service, vec_id, extensions=[".zip", ".tar"])
+    _, zips = _vec_packages(vec_files)
     if not zips:
         return None
+    token = st.session_state["google_token"]
+    try:
+        return _cached_merged(_listing_signature(zips), service, token, vec_id, vec_files)
+    except _MergeFailed:
+        return None  # nada em cache: o próximo rerun tenta de novo
+
+
+class _MergeFailed(Exception):
+    """Nenhum pacote carregou; levantada para o st.cache_resource não guardar o None."""
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _cached_merged(sig: str, _service, _token: Dict[str, Any], _vec_id: str, _vec_files: List[dict]):
+    # chave = só a assinatura; args com "_" não entram no hash
+    merged_dir = os.path.join(FAISS_CACHE_DIR, f"merged_{sig}")
+    if os.path.isdir(merged_dir):
+        try:
+            return load_faiss_index_mmap(merged_dir)
+        except Exception:
+            shutil.rmtree(merged_dir, ignore_errors=True)
+
+    store = _merge_global(_service, _token, _vec_id, _vec_files)
+    if store is not None:
+        try:
+            store = compact_faiss_index(store)  # IVF-PQ quando o acervo é grande
+        except Exception:
+            pass
+        os.makedirs(FAISS_CACHE_DIR, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix="tmp_", dir=FAISS_CACHE_DIR)
+        try:
+            save_faiss_index(store, tmp)
+            os.rename(tmp, merged_dir)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        _prune_merged_cache(keep=merged_dir)
+        try:
+            # troca a cópia em RAM pela versão mapeada do disco
+            return load_faiss_index_mmap(merged_dir)
+        except Exception:
+            pass
+    if store is None:
+        raise _MergeFailed(sig)
+    return store
+
+
+def _prune_merged_cache(keep: str) -> None:
+    merged = [e for e in os.scandir(FAISS_CACHE_DIR) if e.is_dir() and e.name.startswith("merged_")]
+    merged.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for e in merged[FAISS_MERGED_MAX:]:
+        if e.path != keep:
+            shutil.rmtree(e.path, ignore_errors=True)
+
+
+def _merge_global(service, token: Dict[str, Any], vec_id: str, vec_files: List[dict]):
+    """
+    Mescla os pacotes da Vecstore. O merge dos pacotes que não são de chat é salvo em
+    `_snapshot.faiss.zip`; nas cargas seguintes baixa-se o snapshot e só os pacotes mais novos
+    que ele. O snapshot é descartado (merge completo) se algum pacote que ele cobre mudou ou sumiu.
+    """
+    snapshot, zips = _vec_packages(vec_files)
+    pkgs = [f for f in zips if not f["name"].startswith(CHAT_PKG_PREFIX)]
+    chats = [f for f in zips if f["name"].startswith(CHAT_PKG_PREFIX)]
 
     base_store = None
-    for fmeta in zips:
+    pending = pkgs
+    if snapshot is not None:
+        snap_time = snapshot.get("modifiedTime", "")
+        older = [f for f in pkgs if f.get("modifiedTime", "") <= snap_time]
+        if (snapshot.get("appProperties") or {}).get("snapshot_of") == _snapshot_key(older):
+            try:
+                base_store = _load_package(service, snapshot)
+                pending = [f for f in pkgs if f.get("modifiedTime", "") > snap_time]
+            except Exception:
+                logger.warning("Snapshot ilegível: refazendo o merge completo", exc_info=True)
+                base_store = None
+
+    merged = 0
+    for fmeta, store in _load_packages_parallel(token, pending):
+        base_store, ok = _merge_into(base_store, store, fmeta["name"])
+        merged += ok
+
+    # o snapshot só é gravado se cobre todos os pacotes: com falha, a carga seguinte refaz o merge
+    if pending and base_store is not None and merged == len(pending):
         try:
-            data = download_binary(service, fmeta["id"])
-            td = _unzip_bytes_to_tempdir(data)
-            store = load_faiss_index(td)
-            if base_store is None:
-                base_store = store
-            else:
-                try:
-                    base_store.merge_from(store)
-                except Exception:
-                    pass
+            _save_snapshot(service, vec_id, snapshot, base_store, _snapshot_key(pkgs))
         except Exception:
-            continue
+            logger.warning("Falha ao salvar o snapshot da Vecstore", exc_info=True)  # só otimização
+
+    for fmeta, store in _load_packages_parallel(token, chats):
+        base_store, _ = _merge_into(base_store, store, fmeta["name"])
     return base_store
 
 
@@ -117,19 +377,22 @@ def _new_chat_filename() -> str:
     return f"chat_{ts}.txt"
 
 
-def _append_to_chat_file(service, chat_file_id: str, role: str, text: str) -> None:
+def _append_to_chat_file(service, chat_file_id: str, role: str, text: str) -> str:
+    """Anexa um bloco ao chat no Drive e retorna o texto completo enviado."""
     try:
         current = download_text(service, chat_file_id)
     except Exception:
         current = ""
     stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     block = f"[{stamp}] {role.upper()}:\n{text.rstrip()}\n\n"
-    new_bytes = (current + block).encode("utf-8")
-    update_file_contents(service, chat_file_id, new_bytes, mimetype="text/plain")
+    new_text = current + block
+    update_file_contents(service, chat_file_id, new_text.encode("utf-8"), mimetype="text/plain")
+    return new_text
 
 
-def _load_last_chat_file(service, chats_folder_id: str) -> Optional[dict]:
-    files = list_files_md(service, chats_folder_id, extensions=[".txt"])
+def _load_last_chat_file(service, chats_folder_id: str, files: Optional[List[dict]] = None) -> Optional[dict]:
+    if files is None:
+        files = list_files_md(service, chats_folder_id, extensions=[".txt"])
     return files[0] if files else None
 
 
@@ -144,16 +407,68 @@ def _update_chat_embeddings(service, vec_folder_id: str, chat_file_id: str, chat
     if not chat_text.strip():
         return
     index = create_faiss_index([chat_text])
-    with tempfile.TemporaryDirectory() as td:
-        save_faiss_index(index, td)
-        data = _zip_dir_to_bytes(td)
+    data = faiss_index_to_tar_bytes(index)
 
-    pkg_name = f"chat-{chat_file_id}.faiss.zip"
+    pkg_name = f"{CHAT_PKG_PREFIX}{chat_file_id}.faiss.tar"
     existing = list_files_in_folder(service, vec_folder_id, name_equals=pkg_name)
     if existing:
-        update_file_contents(service, existing[0]["id"], data, mimetype="application/zip")
+        update_file_contents(service, existing[0]["id"], data, mimetype="application/x-tar")
     else:
-        upload_binary(service, vec_folder_id, pkg_name, data, mimetype="application/zip")
+        upload_binary(service, vec_folder_id, pkg_name, data, mimetype="application/x-tar")
+
+
+def _append_turn(token: Dict[str, Any], chat_file_id: str, role: str, text: str) -> None:
+    _append_to_chat_file(drive_service_from_token(token), chat_file_id, role, text)
+
+
+def _persist_assistant_turn(token: Dict[str, Any], vec_folder_id: str, chat_file_id: str, answer: str) -> None:
+    svc = drive_service_from_token(token)
+    # reaproveita o texto já montado no append (evita um GET extra no Drive)
+    full_chat_text = _append_to_chat_file(svc, chat_file_id, "assistant", answer)
+    try:
+        _update_chat_embeddings(svc, vec_folder_id, chat_file_id, full_chat_text)
+    except Exception as e:
+        raise RuntimeError(f"Memória do chat salva, mas houve falha ao indexar no Vecstore: {e}") from e
+
+
+# ==========================
+# Escritas em segundo plano
+# ==========================
+def _io_pool() -> ThreadPoolExecutor:
+    """
+    Executor da sessão para as escritas no Drive (fora do caminho crítico da UI).
+    Um único worker preserva a ordem dos appends no arquivo do chat. As tarefas rodam
+    sem contexto do Streamlit: recebem o token e criam o próprio service (httplib2 não é thread-safe).
+    """
+    pool = st.session_state.get("_io_pool")
+    if pool is None:
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive-io")
+        st.session_state["_io_pool"] = pool
+    return pool
+
+
+def _submit_io(fn, *args) -> None:
+    st.session_state["_io_errors"] = []  # erros da escrita anterior saem com a próxima
+    st.session_state.setdefault("_io_futures", []).append(_io_pool().submit(fn, *args))
+
+
+@st.fragment(run_every=IO_POLL_SECONDS)
+def _render_io_status() -> None:
+    """
+    Badge das escritas em segundo plano. Fragmento com run_every: quando uma escrita termina
+    (ou falha), o badge some e o erro aparece sem esperar a próxima interação do usuário.
+    """
+    futs = st.session_state.get("_io_futures", [])
+    errors = st.session_state.setdefault("_io_errors", [])
+    for fut in [f for f in futs if f.done()]:
+        futs.remove(fut)
+        err = fut.exception()
+        if err is not None:
+            errors.append(str(err))
+    for msg in errors:
+        st.warning(msg)
+    if futs:
+        st.caption("💾 salvando...")
 
 
 # ==========================
@@ -163,25 +478,33 @@ def _search_web_duckduckgo(q: str, k: int = 3) -> str:
     if DDGS is None:
         return "⚠️ Módulo `duckduckgo_search` não está instalado no servidor."
     backends = ("api", "html", "lite")
+    attempts = 3
     last_err = None
-    for backend in backends:
-        for attempt in range(3):
-            try:
-                with DDGS() as ddgs:
-                    results = list(ddgs.text(q, max_results=k, backend=backend))
-                if results:
-                    out = []
-                    for i, r in enumerate(results, start=1):
-                        title = (r.get("title") or "").strip()
-                        href = (r.get("href") or "").strip()
-                        body = (r.get("body") or "").strip()
-                        out.append(f"{i}. {title}\n{href}\n{body}\n")
-                    return "\n".join(out)
-                break
-            except Exception as e:
-                last_err = e
-                time.sleep(1.5 * (attempt + 1))
-                continue
+    try:
+        # uma única sessão DDGS para todos os backends (evita novo handshake TLS por tentativa)
+        with DDGS() as ddgs:
+            for backend in backends:
+                for attempt in range(attempts):
+                    try:
+                        results = list(ddgs.text(q, max_results=k, backend=backend))
+                    except Exception as e:
+                        last_err = e
+                        if "ratelimit" in e.__class__.__name__.lower():
+                            if attempt < attempts - 1:
+                                time.sleep(1.5 * (2 ** attempt))  # backoff exponencial só em rate limit
+                            continue
+                        break  # outro erro: tenta o próximo backend
+                    if results:
+                        out = []
+                        for i, r in enumerate(results, start=1):
+                            title = (r.get("title") or "").strip()
+                            href = (r.get("href") or "").strip()
+                            body = (r.get("body") or "").strip()
+                            out.append(f"{i}. {title}\n{href}\n{body}\n")
+                        return "\n".join(out)
+                    break
+    except Exception as e:
+        last_err = e  # falha ao abrir/fechar a sessão DDGS
     if last_err:
         return f"⚠️ Falha na busca web (rate limit/erro do DDG). Tente novamente.\nDetalhe: {type(last_err).__name__}"
     return "Nenhum resultado encontrado."
@@ -193,7 +516,31 @@ def _get_llm() -> Optional[ChatOpenAI]:
     if _ChatOpenAI is None:
         return None
     os.environ["OPENAI_API_KEY"] = st.session_state["OPENAI_API_KEY"]
-    return _ChatOpenAI(model="gpt-4o-mini", temperature=0.3, streaming=True, openai_api_key=st.session_state["OPENAI_API_KEY"])
+    return _cached_llm(st.session_state["OPENAI_API_KEY"])
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _cached_llm(api_key: str) -> ChatOpenAI:
+    # um cliente por chave, compartilhado entre reruns (mantém as conexões HTTP abertas)
+    return _ChatOpenAI(model="gpt-4o-mini", temperature=0.3, streaming=True, openai_api_key=api_key)
+
+
+def _stream_to_placeholder(llm: ChatOpenAI, messages: List[dict], placeholder) -> str:
+    acc = ""
+    buf = ""
+    last_flush = time.monotonic()
+    for chunk in llm.stream(messages):
+        buf += (chunk.content or "")
+        now = time.monotonic()
+        if now - last_flush > STREAM_FLUSH_SECONDS or len(buf) > STREAM_FLUSH_CHARS:
+            acc += buf
+            buf = ""
+            placeholder.markdown(acc)
+            last_flush = now
+    if buf or not acc:
+        acc += buf
+        placeholder.markdown(acc)
+    return acc
 
 
 def _copy_widget(text: str):
@@ -202,13 +549,53 @@ def _copy_widget(text: str):
         st.code(text, language=None)
 
 
+def _prewarm_llm(llm: ChatOpenAI) -> None:
+    """Abre (ou reaproveita) a conexão HTTP com a OpenAI enquanto a busca no acervo roda."""
+    client = getattr(llm, "root_client", None)
+    if client is None:
+        return
+    try:
+        client.models.retrieve(llm.model_name)
+    except Exception:
+        pass
+
+
+def _retrieve(store, question: str, k: int) -> list:
+    memo = st.session_state.get("_retrieval_cache")
+    if memo is None or memo["store"] is not store:
+        memo = {"store": store, "items": {}}  # índice recarregado: descarta o memo
+        st.session_state["_retrieval_cache"] = memo
+    items: Dict[tuple, list] = memo["items"]
+    key = (question, k)
+    if key not in items:
+        if len(items) >= RETRIEVAL_CACHE_MAX:
+            items.pop(next(iter(items)))  # descarta a mais antiga
+        items[key] = store.similarity_search_by_vector(embed_query_cached(question), k=k)
+    return items[key]
+
+
 def _rag_answer(llm: ChatOpenAI, question: str, store, k: int) -> str:
+    # handshake TLS com a OpenAI em paralelo à busca (o pool do httpx expira conexões ociosas em segundos)
+    threading.Thread(target=_prewarm_llm, args=(llm,), daemon=True).start()
+
     context_blocks: List[str] = []
     if store is not None and k > 0:
         try:
-            docs = store.similarity_search(question, k=k)
+            docs = _retrieve(store, question, k)
+            seen = set()
+            used = 0
             for d in docs:
-                context_blocks.append(d.page_content)
+                content = (d.page_content or "").strip()
+                # trechos quase idênticos (overlap do splitter, chunks repetidos) entram uma vez só
+                h = hashlib.sha1(content[:200].encode("utf-8")).digest()
+                if not content or h in seen:
+                    continue
+                seen.add(h)
+                block, n_tok = truncate_tokens(content, CTX_BLOCK_MAX_TOKENS)
+                if used + n_tok > CTX_TOTAL_MAX_TOKENS:
+                    break
+                context_blocks.append(block)
+                used += n_tok
         except Exception:
             pass
 
@@ -228,21 +615,27 @@ def _rag_answer(llm: ChatOpenAI, question: str, store, k: int) -> str:
 
     with st.chat_message("assistant"):
         placeholder = st.empty()
-        acc = ""
-        for chunk in llm.stream(messages):
-            acc += (chunk.content or "")
-            placeholder.markdown(acc)
+        acc = _stream_to_placeholder(llm, messages, placeholder)
         _copy_widget(acc)
         return acc
 
 
+@st.cache_data(show_spinner=False, max_entries=64)
+def _summarize_tail_cached(key: str, _tail: str, _llm: ChatOpenAI) -> str:
+    # cache indexado só por `key` (hash do trecho); args com "_" não entram no hash
+    sys = "Resuma a conversa a seguir em no máximo 6 bullets claros e específicos. Não invente conteúdo."
+    out = _llm.invoke([{"role": "system", "content": sys}, {"role": "user", "content": _tail}])
+    return getattr(out, "content", "") or ""
+
+
 def _summarize_chat_if_any(llm: Optional[ChatOpenAI], text: str) -> str:
     if not text.strip() or llm is None:
         return ""
-    sys = "Resuma a conversa a seguir em no máximo 6 bullets claros e específicos. Não invente conteúdo."
-    usr = text[-8000:]
-    out = llm.invoke([{"role": "system", "content": sys}, {"role": "user", "content": usr}])
-    return getattr(out, "content", "") or ""
+    tail = text[-8000:]
+    if len(tail) < 500:
+        return ""  # conversa curta demais para valer uma chamada ao LLM
+    key = hashlib.blake2b(tail.encode("utf-8"), digest_size=8).hexdigest()
+    return _summarize_tail_cached(key, tail, llm)
 
 
 # ==========================
@@ -263,7 +656,7 @@ if llm is None:
     st.error("Não foi possível iniciar o modelo (verifique a instalação de `langchain-openai`).")
     st.stop()
 
-service = drive_service_from_token(st.session_state["google_token"])
+service = drive_service_for_session(st.session_state["google_token"])
 
 st.session_state.setdefault("messages", [])
 st.session_state.setdefault("faiss_loaded", False)
@@ -276,7 +669,10 @@ with st.sidebar:
     st.header("🔧 Controles")
     k_acervo = st.slider("Trechos do acervo (top-k)", 1, 12, 8, 1)
     do_web = st.toggle("Permitir pesquisa web quando a pergunta começar com **web:**", value=True)
+    io_status = st.empty()  # preenchido no fim do script, depois das escritas desta execução
+    reloaded_now = False
     if st.button("Recarregar índice global (Vecstore)"):
+        reloaded_now = True
         with st.spinner("Carregando índice global a partir do Drive..."):
             store = _load_global_index_from_drive(service)
             st.session_state["faiss_store"] = store
@@ -286,7 +682,7 @@ with st.sidebar:
             else:
                 st.success("Índice global recarregado.")
     if st.button("🆕 Iniciar novo chat"):
-        ids = ensure_user_tree(service)
+        ids = ensure_user_tree_cached(service)
         root_id = ids["root"]
         chats_id = _ensure_chat_folder(service, root_id)
         st.session_state["chat_folder_id"] = chats_id
@@ -297,23 +693,37 @@ with st.sidebar:
         st.session_state["chat_loaded_once"] = True
         st.success("Novo chat iniciado.")
 
-ids = ensure_user_tree(service)
+ids = ensure_user_tree_cached(service)
 root_id = ids["root"]
 vec_id = ids["vec"]
 
-if not st.session_state["faiss_loaded"]:
+# Cold start: lista Vecstore e Chats numa única passada concorrente
+need_vec = not st.session_state["faiss_loaded"] and not reloaded_now
+need_chats = not st.session_state["chat_loaded_once"]
+vec_files: Optional[List[dict]] = None
+chat_files: Optional[List[dict]] = None
+if need_chats:
+    chats_id = st.session_state.get("chat_folder_id") or _ensure_chat_folder(service, root_id)
+    st.session_state["chat_folder_id"] = chats_id
+if need_vec or need_chats:
+    vec_files, chat_files = _list_vec_and_chats(
+        st.session_state["google_token"],
+        vec_id if need_vec else None,
+        st.session_state["chat_folder_id"] if need_chats else None,
+    )
+
+if need_vec:
     with st.spinner("Carregando índice global a partir do Drive..."):
-        store = _load_global_index_from_drive(service)
+        store = _load_global_index_from_drive(service, vec_files)
         st.session_state["faiss_store"] = store
         st.session_state["faiss_loaded"] = store is not None
         if store is None:
             st.info(f"A pasta **{VECSTORE_DIR}** ainda não tem pacotes de embeddings (.faiss.zip). "
                     "Salve versões no **Editor** para populá-la.")
 
-if not st.session_state["chat_loaded_once"]:
-    chats_id = _ensure_chat_folder(service, root_id)
-    st.session_state["chat_folder_id"] = chats_id
-    last = _load_last_chat_file(service, chats_id)
+if need_chats:
+    chats_id = st.session_state["chat_folder_id"]
+    last = _load_last_chat_file(service, chats_id, chat_files)
     if last:
         st.session_state["chat_file_id"] = last["id"]
         chat_text = _download_chat_text(service, last["id"])
@@ -337,21 +747,22 @@ if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
     if st.session_state.get("chat_file_id"):
-        _append_to_chat_file(service, st.session_state["chat_file_id"], "user", prompt)
+        _submit_io(_append_turn, st.session_state["google_token"], st.session_state["chat_file_id"], "user", prompt)
 
     if do_web and prompt.strip().lower().startswith("web:"):
         query = prompt.split(":", 1)[1].strip() or prompt
-        with st.spinner("Buscando na web (DuckDuckGo)..."):
-            web_text = _search_web_duckduckgo(query, k=5)
-        sys = "Você é um assistente que sintetiza resultados de busca em respostas claras e objetivas."
-        usr = f"Consulta: {query}\n\nResultados:\n{web_text}\n\nResuma e responda de forma útil."
-        messages = [{"role": "system", "content": sys}, {"role": "user", "content": usr}]
         with st.chat_message("assistant"):
             placeholder = st.empty()
-            acc = ""
-            for chunk in llm.stream(messages):
-                acc += (chunk.content or "")
-                placeholder.markdown(acc)
+            placeholder.markdown("_🔎 Buscando na web (DuckDuckGo)…_")
+            # busca numa thread enquanto a conexão com a OpenAI é aberta em paralelo
+            with ThreadPoolExecutor(max_workers=1) as ex:
+                fut = ex.submit(_search_web_duckduckgo, query, 5)
+                threading.Thread(target=_prewarm_llm, args=(llm,), daemon=True).start()
+                web_text = fut.result()
+            sys = "Você é um assistente que sintetiza resultados de busca em respostas claras e objetivas."
+            usr = f"Consulta: {query}\n\nResultados:\n{web_text}\n\nResuma e responda de forma útil."
+            messages = [{"role": "system", "content": sys}, {"role": "user", "content": usr}]
+            acc = _stream_to_placeholder(llm, messages, placeholder)
             _copy_widget(acc)
         answer = acc
     else:
@@ -360,12 +771,16 @@ if prompt:
     st.session_state["messages"].append({"role": "assistant", "content": answer})
 
     if st.session_state.get("chat_file_id"):
-        _append_to_chat_file(service, st.session_state["chat_file_id"], "assistant", answer)
-        try:
-            full_chat_text = _download_chat_text(service, st.session_state["chat_file_id"])
-            _update_chat_embeddings(service, vec_id, st.session_state["chat_file_id"], full_chat_text)
-        except Exception as e:
-            st.warning(f"Memória do chat salva, mas houve falha ao indexar no Vecstore: {e}")
+        _submit_io(
+            _persist_assistant_turn,
+            st.session_state["google_token"],
+            vec_id,
+            st.session_state["chat_file_id"],
+            answer,
+        )
+
+with io_status.container():
+    _render_io_status()
 
 
 
@@ -1,97 +1,115 @@
 # src/embeddings/faiss_drive.py
 from __future__ import annotations
 
-import io
-import os
+import functools
+import json
+import logging
+import threading
 import time
-import zipfile
-import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, List, Optional, Tuple
 
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 
+from src.embeddings.vectorstore_faiss import (
+    faiss_index_to_zip_bytes,
+    load_faiss_index_from_zip_bytes,
+    quantize_faiss_index,
+    to_flat_faiss_index,
+)
+from src.knowledge.repo import ensure_user_tree
 from src.storage.drive import (
-    ensure_app_folder,
+    drive_service_from_token,
     ensure_subfolder,
     list_files_in_folder,
-    find_file,
-    download_file,
-    upload_bytes,
-    update_file_bytes,
+    list_files_md,
+    download_binary,
+    upload_binary,
+    update_file_contents,
 )
 
+logger = logging.getLogger(__name__)
+
 FAISS_DIRNAME = "faiss"
 GLOBAL_INDEX_BASENAME = "_global.faiss.zip"
+GLOBAL_MANIFEST_BASENAME = "_global.manifest.json"  # {nome do zip: modifiedTime} já contidos no global
+DOWNLOAD_WORKERS = 8  # downloads paralelos dos {doc_id}.faiss.zip
 
 
 # ---------- Helpers de pasta/Drive ----------
 
+@functools.lru_cache(maxsize=4)
+def _get_embeddings(openai_api_key: Optional[str]) -> OpenAIEmbeddings:
+    # uma instância por chave: upserts/rebuilds seguidos reaproveitam o cliente HTTP
+    return OpenAIEmbeddings(api_key=openai_api_key)
+
+
+_local = threading.local()
+_FOLDER_IDS: Dict[str, str] = {}  # pasta faiss/ por conta (refresh_token), já resolvida
+
+
+def _service(token: Dict[str, Any]):
+    """Service da thread atual (o httplib2 não é thread-safe), refeito só quando o token gira."""
+    cached = getattr(_local, "service", None)
+    if cached is not None and cached[0] == token.get("access_token"):
+        return cached[1]
+    svc = drive_service_from_token(token)  # pode renovar o access_token no próprio dict
+    _local.service = (token.get("access_token"), svc)
+    return svc
+
+
 def _faiss_folder_id(token: Dict[str, Any]) -> str:
-    root_id = ensure_app_folder(token)
-    vec_id = ensure_subfolder(token, root_id, "vecstore")
-    return ensure_subfolder(token, vec_id, FAISS_DIRNAME)
+    key = token.get("refresh_token") or token.get("access_token") or ""
+    fid = _FOLDER_IDS.get(key)
+    if fid is None:
+        svc = _service(token)
+        fid = ensure_subfolder(svc, ensure_user_tree(svc)["vec"], FAISS_DIRNAME)
+        _FOLDER_IDS[key] = fid
+    return fid
 
 
 def _name_for_doc(doc_id: str) -> str:
     return f"{doc_id}.faiss.zip"
 
 
+def _doc_id_for_name(name: str) -> str:
+    return name[: -len(".faiss.zip")] if name.endswith(".faiss.zip") else name
+
+
+def _find_file_id(token: Dict[str, Any], parent_id: str, name: str) -> Optional[str]:
+    files = list_files_in_folder(_service(token), parent_id, name_equals=name)
+    return files[0]["id"] if files else None
+
+
 def _get_file_bytes(token: Dict[str, Any], parent_id: str, name: str) -> Optional[bytes]:
-    fid = find_file(token, name, parent_id=parent_id)
+    fid = _find_file_id(token, parent_id, name)
     if not fid:
         return None
-    return download_file(token, fid)
+    return download_binary(_service(token), fid)
 
 
-def _put_file_bytes(token: Dict[str, Any], parent_id: str, name: str, data: bytes) -> str:
-    fid = find_file(token, name, parent_id=parent_id)
+def _put_file_bytes(
+    token: Dict[str, Any], parent_id: str, name: str, data: bytes, mime: str = "application/zip"
+) -> str:
+    fid = _find_file_id(token, parent_id, name)
     if fid:
-        return update_file_bytes(token, fid, name, data, mime="application/zip")
-    return upload_bytes(token, name, data, parent_id=parent_id, mime="application/zip")
+        update_file_contents(_service(token), fid, data, mimetype=mime)
+        return fid
+    return upload_binary(_service(token), parent_id, name, data, mimetype=mime)
 
 
 # ---------- Helpers de zip/FAISS ----------
 
 def _save_vectorstore_to_zip_bytes(vs: FAISS) -> bytes:
-    """Salva FAISS em pasta temp e retorna um zip daquela pasta como bytes."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        index_dir = os.path.join(tmpdir, "faiss_index")
-        vs.save_local(index_dir)
-
-        buf = io.BytesIO()
-        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as z:
-            for root, _, files in os.walk(index_dir):
-                for fn in files:
-                    full = os.path.join(root, fn)
-                    # mantém a subpasta 'faiss_index' dentro do zip
-                    arcname = os.path.relpath(full, start=tmpdir)
-                    z.write(full, arcname)
-        return buf.getvalue()
+    """Serializa o FAISS direto em memória e retorna o zip (subpasta 'faiss_index') como bytes."""
+    vs = quantize_faiss_index(vs)  # EMBEDDING_PRECISION=int8|fp16 reduz bytes enviados
+    return faiss_index_to_zip_bytes(vs, folder="faiss_index")
 
 
 def _load_vectorstore_from_zip_bytes(zip_bytes: bytes, embeddings: OpenAIEmbeddings) -> FAISS:
-    """Carrega FAISS de bytes zipados — tolerante a zips antigos (com/sem pasta)."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        with zipfile.ZipFile(io.BytesIO(zip_bytes), "r") as z:
-            z.extractall(tmpdir)
-
-        # 1) Preferir diretórios (p.ex. faiss_index/)
-        dirs = [p for p in os.listdir(tmpdir) if os.path.isdir(os.path.join(tmpdir, p))]
-        if dirs:
-            # escolha a primeira pasta que contenha arquivos do índice
-            for cand in dirs:
-                cand_dir = os.path.join(tmpdir, cand)
-                files = os.listdir(cand_dir)
-                if any(fname.endswith((".faiss", ".pkl", ".json")) for fname in files):
-                    return FAISS.load_local(cand_dir, embeddings, allow_dangerous_deserialization=True)
-
-        # 2) Caso não haja diretório, tente raiz (zip antigo com arquivos na raiz)
-        if any(fname.endswith((".faiss", ".pkl", ".json")) for fname in os.listdir(tmpdir)):
-            return FAISS.load_local(tmpdir, embeddings, allow_dangerous_deserialization=True)
-
-        # 3) Se nada bater, considere estrutura inesperada
-        raise RuntimeError("Estrutura inesperada dentro do zip do FAISS.")
+    """Carrega FAISS de bytes zipados — tolerante a zips antigos (com/sem pasta), sem extrair para disco."""
+    return load_faiss_index_from_zip_bytes(zip_bytes, embeddings)
 
 
 def _empty_index(embeddings: OpenAIEmbeddings) -> FAISS:
@@ -105,7 +123,8 @@ def _load_or_create_index(token: Dict[str, Any], name: str, embeddings: OpenAIEm
     if bin_data is None:
         return _empty_index(embeddings), False
     try:
-        return _load_vectorstore_from_zip_bytes(bin_data, embeddings), True
+        # pacotes podem estar quantizados: opera sempre sobre Flat e re-quantiza ao salvar
+        return to_flat_faiss_index(_load_vectorstore_from_zip_bytes(bin_data, embeddings)), True
     except Exception:
         # não aborta: volta com índice vazio; próximo save sobrescreve
         return _empty_index(embeddings), False
@@ -132,7 +151,7 @@ def upsert_texts_to_drive_index(
     if not texts:
         return {"added": 0}
 
-    embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+    embeddings = _get_embeddings(openai_api_key)
 
     # enriquecer metadados
     now = int(time.time())
@@ -144,15 +163,18 @@ def upsert_texts_to_drive_index(
         mm.setdefault("created_at", now)
         enriched.append(mm)
 
+    # embeddings calculados uma vez só e reaproveitados nos dois índices
+    text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+
     # 1) índice do doc
     doc_name = _name_for_doc(doc_id)
     vs_doc, _ = _load_or_create_index(token, doc_name, embeddings)
-    vs_doc.add_texts(texts=texts, metadatas=enriched)
+    vs_doc.add_embeddings(text_embeddings, metadatas=enriched)
     fid_doc = _save_index(token, doc_name, vs_doc)
 
     # 2) índice global
     vs_global, _ = _load_or_create_index(token, GLOBAL_INDEX_BASENAME, embeddings)
-    vs_global.add_texts(texts=texts, metadatas=enriched)
+    vs_global.add_embeddings(text_embeddings, metadatas=enriched)
     fid_glob = _save_index(token, GLOBAL_INDEX_BASENAME, vs_global)
 
     return {"doc_index_saved": fid_doc, "global_index_saved": fid_glob, "added": len(texts)}
@@ -160,41 +182,125 @@ def upsert_texts_to_drive_index(
 
 # ---------- Reconstrução do global a partir dos docs ----------
 
+def _download_and_load(token: Dict[str, Any], file_id: str, embeddings: OpenAIEmbeddings) -> Optional[FAISS]:
+    try:
+        data = download_binary(_service(token), file_id)  # service próprio de cada worker
+        return to_flat_faiss_index(_load_vectorstore_from_zip_bytes(data, embeddings))
+    except Exception:
+        logger.warning("Pacote %s ignorado no rebuild", file_id, exc_info=True)
+        return None
+
+def _load_manifest(token: Dict[str, Any], parent_id: str) -> Dict[str, str]:
+    data = _get_file_bytes(token, parent_id, GLOBAL_MANIFEST_BASENAME)
+    if not data:
+        return {}
+    try:
+        sources = json.loads(data).get("sources")
+    except (ValueError, AttributeError):
+        return {}
+    return sources if isinstance(sources, dict) else {}
+
+
+def _is_bootstrap(doc) -> bool:
+    return bool((doc.metadata or {}).get("bootstrap"))
+
+
+def _evict_docs(vs: FAISS, doc_ids: set) -> int:
+    """
+    Remove do índice os vetores cujo metadata doc_id está em `doc_ids`, e também os
+    "__bootstrap__" (sem doc_id; todo índice criado por _empty_index carrega um).
+    """
+    stale = [
+        sid for sid, doc in vs.docstore._dict.items()
+        if _is_bootstrap(doc) or (doc.metadata or {}).get("doc_id") in doc_ids
+    ]
+    if stale:
+        vs.delete(stale)
+    return len(stale)
+
+
+def _merge_doc(merged: Optional[FAISS], vs_doc: FAISS) -> FAISS:
+    """
+    Junta `vs_doc` ao global. Antes do merge_from (que grava os vetores antes de checar o
+    docstore), tira do global qualquer id repetido: o zip do doc é a fonte da verdade.
+    """
+    _evict_docs(vs_doc, set())  # bootstrap do doc não vai para o global
+    if merged is None:
+        return vs_doc
+    dup = [sid for sid in vs_doc.index_to_docstore_id.values() if sid in merged.docstore._dict]
+    if dup:
+        merged.delete(dup)
+    merged.merge_from(vs_doc)
+    return merged
+
+
 def rebuild_global_from_all_docs(
     token: Dict[str, Any],
     openai_api_key: Optional[str] = None,
+    full: bool = False,
 ) -> Dict[str, Any]:
     """
-    Reconstrói o índice global agregando TODOS os {doc_id}.faiss.zip (ignora _global).
+    Reconstrói o índice global a partir dos {doc_id}.faiss.zip (ignora _global).
+    Incremental: com o manifest, só baixa os docs novos/alterados (modifiedTime) e remove do
+    global os vetores dos alterados/apagados. `full=True` (ou sem manifest) refaz do zero.
     """
-    embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+    embeddings = _get_embeddings(openai_api_key)
     parent_id = _faiss_folder_id(token)
 
-    all_doc_zips = list_files_in_folder(token, parent_id, name_suffix=".faiss.zip", limit=1000)
+    all_doc_zips = list_files_md(_service(token), parent_id, extensions=[".faiss.zip"])
     all_doc_zips = [f for f in all_doc_zips if f["name"] != GLOBAL_INDEX_BASENAME]
-
-    if not all_doc_zips:
-        vs_global = _empty_index(embeddings)
-        fid = _save_index(token, GLOBAL_INDEX_BASENAME, vs_global)
-        return {"global_index_saved": fid, "sources": 0}
+    current = {f["name"]: f.get("modifiedTime", "") for f in all_doc_zips}
 
     merged: Optional[FAISS] = None
-    sources = 0
-    for f in all_doc_zips:
-        data = download_file(token, f["id"])
-        try:
-            vs_doc = _load_vectorstore_from_zip_bytes(data, embeddings)
-        except Exception:
-            continue  # pula zips antigos/corrompidos
-        if merged is None:
-            merged = vs_doc
+    manifest = {} if full else _load_manifest(token, parent_id)
+    if manifest:
+        vs_global, loaded = _load_or_create_index(token, GLOBAL_INDEX_BASENAME, embeddings)
+        if loaded:
+            merged = vs_global
         else:
-            merged.merge_from(vs_doc)
-        sources += 1
+            manifest = {}  # global ilegível: o manifest não vale mais
+
+    changed = [
+        f for f in all_doc_zips
+        if not current[f["name"]] or manifest.get(f["name"]) != current[f["name"]]
+    ]
+    removed = set(manifest) - set(current)
+    if merged is not None:
+        _evict_docs(merged, {_doc_id_for_name(n) for n in removed | {f["name"] for f in changed}})
+        if not merged.index_to_docstore_id:
+            merged = None  # nada sobrou do global: o primeiro doc vira a base
+
+    updated = 0
+    # cada worker baixa e já extrai (a extração de um sobrepõe o download dos outros);
+    # o merge fica nesta thread, conforme cada pacote termina
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+        futs = {ex.submit(_download_and_load, token, f["id"], embeddings): f["name"] for f in changed}
+        for fut in as_completed(futs):
+            name = futs[fut]
+            vs_doc = fut.result()
+            if vs_doc is None:
+                current.pop(name)  # zip antigo/corrompido: fora do manifest, tenta de novo depois
+                continue
+            try:
+                merged = _merge_doc(merged, vs_doc)
+            except Exception:
+                # um doc ruim não derruba o rebuild; fica fora do manifest e volta na próxima vez
+                logger.exception("Falha ao juntar %s ao índice global", name)
+                current.pop(name)
+                continue
+            updated += 1
 
     if merged is None:
         merged = _empty_index(embeddings)
 
     fid_glob = _save_index(token, GLOBAL_INDEX_BASENAME, merged)
-    return {"global_index_saved": fid_glob, "sources": sources}
-
+    _put_file_bytes(
+        token, parent_id, GLOBAL_MANIFEST_BASENAME,
+        json.dumps({"sources": current}).encode("utf-8"), mime="application/json",
+    )
+    return {
+        "global_index_saved": fid_glob,
+        "sources": len(current),
+        "updated": updated,
+        "removed": len(removed),
+    }
@@ -1,17 +1,56 @@
 # src/embeddings/vectorstore_faiss.py
 from __future__ import annotations
 
+import functools
+import io
 import os
-from typing import List, Optional
+import pickle
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 import streamlit as st
 from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import CharacterTextSplitter
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 
 # Defina um modelo e mantenha SEMPRE o mesmo para evitar conflito de dimensões ao mesclar índices
 EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDINGS_MODEL", "text-embedding-3-small")
 
+# Split por tokens (cl100k_base = encoding dos modelos text-embedding-3-*)
+SPLIT_CHUNK_TOKENS = 512
+SPLIT_OVERLAP_TOKENS = 64
+
+# Embeddings em lotes concorrentes (a API aceita até 2048 entradas por request)
+EMBED_BATCH_SIZE = 512
+EMBED_CONCURRENCY = 8
+
+# Índice compacto (IVF-PQ) para acervos grandes; abaixo disso o Flat exato é melhor
+IVF_FACTORY = os.environ.get("FAISS_IVF_FACTORY", "IVF256,PQ16")
+IVF_MIN_VECTORS = int(os.environ.get("FAISS_IVF_MIN_VECTORS", "10000"))
+IVF_NPROBE = int(os.environ.get("FAISS_NPROBE", "8"))
+
+# Precisão dos vetores nos pacotes salvos: int8 (1/4 dos bytes), fp16 (1/2) ou fp32 (Flat, padrão)
+EMBEDDING_PRECISION = os.environ.get("EMBEDDING_PRECISION", "fp32").lower()
+_SQ_TYPES = {"int8": "QT_8bit", "fp16": "QT_fp16"}
+
+def _available_cpus() -> int:
+    # no container o cpu_count() pode ser o do host; a afinidade reflete o que o processo pode usar
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 4
+
+# Threads OpenMP do Faiss: o padrão (todos os núcleos do host) disputa CPU com o Streamlit
+FAISS_OMP_THREADS = int(os.environ.get("FAISS_OMP_THREADS", str(min(8, _available_cpus()))))
+try:
+    import faiss as _faiss
+
+    _faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+except ImportError:
+    pass
+
 def _ensure_api_key() -> str:
     """Garante que a OPENAI_API_KEY esteja disponível neste processo."""
     key = os.getenv("OPENAI_API_KEY") or st.session_state.get("OPENAI_API_KEY")
@@ -20,38 +59,268 @@ def _ensure_api_key() -> str:
     os.environ["OPENAI_API_KEY"] = key  # garante disponibilidade para libs internas
     return key
 
+@functools.lru_cache(maxsize=4)
+def _get_embeddings(api_key: str, model: str = EMBEDDING_MODEL) -> OpenAIEmbeddings:
+    """Uma instância por (chave, modelo) no processo: reaproveita o cliente HTTP e suas conexões."""
+    return OpenAIEmbeddings(model=model, openai_api_key=api_key)
+
+@functools.lru_cache(maxsize=1)
+def _get_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=SPLIT_CHUNK_TOKENS,
+        chunk_overlap=SPLIT_OVERLAP_TOKENS,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+
+def _embed_documents(embeddings: OpenAIEmbeddings, texts: List[str]) -> List[List[float]]:
+    """Embeddings dos textos em lotes de EMBED_BATCH_SIZE, até EMBED_CONCURRENCY requests simultâneos."""
+    if len(texts) <= EMBED_BATCH_SIZE:
+        return embeddings.embed_documents(texts)
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    # threads sobre o cliente síncrono: o async do OpenAIEmbeddings fica preso ao primeiro
+    # event loop e, com a instância em cache, um segundo asyncio.run dá "Event loop is closed"
+    with ThreadPoolExecutor(max_workers=min(EMBED_CONCURRENCY, len(batches))) as ex:
+        results = ex.map(embeddings.embed_documents, batches)  # mantém a ordem dos lotes
+        return [vec for batch in results for vec in batch]
+
+@functools.lru_cache(maxsize=512)
+def _embed_query(model: str, key: str, question: str) -> Tuple[float, ...]:
+    return tuple(_get_embeddings(key, model).embed_query(question))
+
+def embed_query_cached(question: str) -> List[float]:
+    """Embedding da pergunta com LRU no processo (perguntas repetidas não voltam à OpenAI)."""
+    return list(_embed_query(EMBEDDING_MODEL, _ensure_api_key(), question))
+
 def create_faiss_index(texts: List[str], metadata: Optional[List[dict]] = None) -> FAISS:
     """Cria um índice FAISS a partir de uma lista de textos (com split)."""
-    key = _ensure_api_key()
-    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=key)
-
-    splitter = CharacterTextSplitter(chunk_size=1500, chunk_overlap=100)
+    embeddings = _get_embeddings(_ensure_api_key())
 
-    all_chunks: List[str] = []
-    all_metas: List[dict] = []
+    texts = [t or "" for t in (texts or [])]
+    metas = [metadata[i] if metadata and i < len(metadata) else {} for i in range(len(texts))]
+    docs = _get_splitter().create_documents(texts, metadatas=metas)
 
-    for i, t in enumerate(texts or []):
-        chunks = splitter.split_text(t or "")
-        all_chunks.extend(chunks)
-        if metadata and i < len(metadata):
-            all_metas.extend([metadata[i]] * len(chunks))
-        else:
-            all_metas.extend([{}] * len(chunks))
+    all_chunks: List[str] = [d.page_content for d in docs]
+    all_metas: List[dict] = [d.metadata for d in docs]
 
     if not all_chunks:
         # evita criar índice vazio (que pode quebrar em alguns ambientes)
         all_chunks = [" "]
         all_metas = [{}]
 
-    return FAISS.from_texts(all_chunks, embeddings, metadatas=all_metas)
+    vectors = _embed_documents(embeddings, all_chunks)
+    return FAISS.from_embeddings(list(zip(all_chunks, vectors)), embeddings, metadatas=all_metas)
+
+def create_faiss_indexes(texts: List[str], metadata: Optional[List[dict]] = None) -> List[FAISS]:
+    """
+    Um índice por texto (como create_faiss_index([t]) para cada um), mas os chunks de todos
+    vão numa passada só de embeddings: lotes cheios e concorrentes, não um texto por vez.
+    """
+    embeddings = _get_embeddings(_ensure_api_key())
+    splitter = _get_splitter()
+
+    per_text: List[List[Tuple[str, dict]]] = []
+    for i, text in enumerate(texts):
+        meta = metadata[i] if metadata and i < len(metadata) else {}
+        docs = splitter.create_documents([text or ""], metadatas=[meta])
+        per_text.append([(d.page_content, d.metadata) for d in docs] or [(" ", {})])
+
+    vectors = iter(_embed_documents(embeddings, [c for chunks in per_text for c, _ in chunks]))
+    return [
+        FAISS.from_embeddings(
+            [(c, next(vectors)) for c, _ in chunks], embeddings, metadatas=[m for _, m in chunks]
+        )
+        for chunks in per_text
+    ]
 
 def save_faiss_index(index: FAISS, path: str):
     index.save_local(path)
 
+def _faiss_to_parts(index: FAISS) -> Tuple[bytes, bytes]:
+    """Conteúdo de index.faiss e index.pkl (o mesmo que o save_local gravaria), em memória."""
+    import faiss
+
+    raw = faiss.serialize_index(index.index).tobytes()
+    pkl = pickle.dumps((index.docstore, index.index_to_docstore_id), protocol=5)
+    return raw, pkl
+
+def compress_type_for(name: str) -> int:
+    """
+    index.faiss (floats densos) é praticamente incompressível: vai STORED e poupa o deflate;
+    o resto (index.pkl, json) continua DEFLATED.
+    """
+    return zipfile.ZIP_STORED if name.endswith(".faiss") else zipfile.ZIP_DEFLATED
+
+def faiss_index_to_zip_bytes(index: FAISS, folder: str = "") -> bytes:
+    """
+    Gera o .faiss.zip direto da memória (sem save_local + pasta temp). `folder` é a subpasta
+    dentro do zip (p.ex. "faiss_index"); vazio = arquivos na raiz.
+    """
+    raw, pkl = _faiss_to_parts(index)
+    prefix = f"{folder.strip('/')}/" if folder else ""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for name, payload in (("index.faiss", raw), ("index.pkl", pkl)):
+            z.writestr(prefix + name, payload, compress_type=compress_type_for(name))
+    return buf.getvalue()
+
+def faiss_index_to_tar_bytes(index: FAISS) -> bytes:
+    """
+    Serializa o índice em memória num .tar sem compressão (mesmos nomes do save_local:
+    index.faiss + index.pkl), sem passar pelo disco nem pelo CRC32 do zip.
+    """
+    raw, pkl = _faiss_to_parts(index)
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tf:
+        for name, payload in (("index.faiss", raw), ("index.pkl", pkl)):
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            tf.addfile(info, io.BytesIO(payload))
+    return buf.getvalue()
+
+def faiss_from_bytes(raw_index: bytes, pkl: bytes, embeddings: Optional[OpenAIEmbeddings] = None) -> FAISS:
+    """Monta o FAISS do LangChain a partir do conteúdo de index.faiss + index.pkl (sem disco)."""
+    import faiss
+    import numpy as np
+
+    if embeddings is None:
+        embeddings = _get_embeddings(_ensure_api_key())
+    idx = faiss.deserialize_index(np.frombuffer(raw_index, dtype=np.uint8))
+    docstore, index_to_docstore_id = pickle.loads(pkl)
+    return FAISS(
+        embedding_function=embeddings,
+        index=idx,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+def load_faiss_index_from_tar_bytes(data: bytes) -> FAISS:
+    """Inverso de `faiss_index_to_tar_bytes`."""
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tf:
+        raw = tf.extractfile("index.faiss").read()
+        pkl = tf.extractfile("index.pkl").read()
+    return faiss_from_bytes(raw, pkl)
+
+def load_faiss_index_from_zip_bytes(data: bytes, embeddings: Optional[OpenAIEmbeddings] = None) -> FAISS:
+    """
+    Lê index.faiss/index.pkl direto do zip (na raiz ou numa subpasta, p.ex. faiss_index/),
+    sem extrair para disco.
+    """
+    with zipfile.ZipFile(io.BytesIO(data), "r") as zf:
+        names = set(zf.namelist())
+        faiss_name = next(
+            (n for n in sorted(names) if n == "index.faiss" or n.endswith("/index.faiss")), None
+        )
+        if faiss_name is None or faiss_name[: -len("faiss")] + "pkl" not in names:
+            raise RuntimeError("Estrutura inesperada dentro do zip do FAISS.")
+        raw = zf.read(faiss_name)
+        pkl = zf.read(faiss_name[: -len("faiss")] + "pkl")
+    return faiss_from_bytes(raw, pkl, embeddings)
+
+def _set_nprobe(idx) -> None:
+    import faiss
+
+    try:
+        faiss.extract_index_ivf(idx).nprobe = IVF_NPROBE
+    except RuntimeError:
+        pass  # não é IVF
+
+def compact_faiss_index(index: FAISS) -> FAISS:
+    """
+    Converte um índice Flat grande (>= IVF_MIN_VECTORS) em IVF-PQ, treinado nos próprios vetores.
+    Só para índices finais/somente leitura (p.ex. o global mesclado): IVF não aceita
+    `merge_from` com os pacotes Flat por documento. Abaixo do limite, devolve o próprio índice.
+    """
+    import faiss
+
+    n = index.index.ntotal
+    if n < IVF_MIN_VECTORS:
+        return index
+    xb = index.index.reconstruct_n(0, n)
+    ivf = faiss.index_factory(index.index.d, IVF_FACTORY, index.index.metric_type)
+    ivf.train(xb)
+    ivf.add(xb)
+    _set_nprobe(ivf)
+    return _with_index(index, ivf)
+
+def _with_index(index: FAISS, idx) -> FAISS:
+    return FAISS(
+        embedding_function=index.embedding_function,
+        index=idx,
+        docstore=index.docstore,
+        index_to_docstore_id=index.index_to_docstore_id,
+    )
+
+def quantize_faiss_index(index: FAISS) -> FAISS:
+    """
+    Re-codifica os vetores com ScalarQuantizer conforme EMBEDDING_PRECISION (para salvar/enviar).
+    fp32 (ou valor desconhecido) devolve o próprio índice.
+    """
+    import faiss
+
+    qt_name = _SQ_TYPES.get(EMBEDDING_PRECISION)
+    if qt_name is None:
+        return index
+    qtype = getattr(faiss.ScalarQuantizer, qt_name)
+    idx = index.index
+    if isinstance(idx, faiss.IndexScalarQuantizer) and idx.sq.qtype == qtype:
+        return index
+    xb = idx.reconstruct_n(0, idx.ntotal)
+    sq = faiss.IndexScalarQuantizer(idx.d, qtype, idx.metric_type)
+    sq.train(xb)
+    sq.add(xb)
+    return _with_index(index, sq)
+
+def _flat_index(d: int, metric: int):
+    # mesmo tipo concreto que o FAISS.from_texts/save_local geram: o merge_from exige tipos iguais
+    import faiss
+
+    if metric == faiss.METRIC_L2:
+        return faiss.IndexFlatL2(d)
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return faiss.IndexFlatIP(d)
+    return faiss.IndexFlat(d, metric)
+
+def to_flat_faiss_index(index: FAISS) -> FAISS:
+    """
+    Volta um índice quantizado para Flat fp32 (IndexFlatL2/IndexFlatIP, conforme a métrica),
+    compatível no merge_from com pacotes legados e com os criados por FAISS.from_texts.
+    """
+    import faiss
+
+    idx = index.index
+    if isinstance(idx, (faiss.IndexFlatL2, faiss.IndexFlatIP)):
+        return index
+    flat = _flat_index(idx.d, idx.metric_type)
+    flat.add(idx.reconstruct_n(0, idx.ntotal))
+    return _with_index(index, flat)
+
+def load_faiss_index_mmap(path: str) -> FAISS:
+    """
+    Abre um índice salvo com `save_faiss_index` via mmap, somente leitura: o kernel pagina
+    só o que as buscas tocam e várias sessões compartilham as mesmas páginas.
+    O índice retornado não aceita escrita (add/merge_from).
+    """
+    import faiss
+
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags |= faiss.IO_FLAG_MMAP_IFC  # faiss recente: mapeia também os códigos de índices Flat
+    embeddings = _get_embeddings(_ensure_api_key())
+    idx = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+    _set_nprobe(idx)
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=idx,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
 def load_faiss_index(path: str) -> FAISS:
     """Carrega um índice FAISS salvo em disco (precisa de embeddings para buscas)."""
-    key = _ensure_api_key()
-    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=key)
+    embeddings = _get_embeddings(_ensure_api_key())
     # allow_dangerous_deserialization é necessário em alguns ambientes/versões
     return FAISS.load_local(path, embeddings=embeddings, allow_dangerous_deserialization=True)
 
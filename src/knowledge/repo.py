@@ -1,10 +1,14 @@
 # src/knowledge/repo.py
 from __future__ import annotations
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-from src.storage.drive import find_or_create_folder, ensure_subfolder
+import streamlit as st
+
+from src.storage.drive import find_or_create_folder, ensure_subfolders, upload_many
 
 # Nome do diretório raiz do app no Drive
 ROOT_DIR_NAME = "Agente_Livro"
@@ -20,19 +24,29 @@ def ensure_user_tree(service) -> Dict[str, str]:
     Garante a árvore de pastas do usuário no Drive e retorna os IDs.
     """
     root_id = find_or_create_folder(service, ROOT_DIR_NAME)
-    trans_id = ensure_subfolder(service, root_id, TRANSCRICAO_DIR)
-    versions_id = ensure_subfolder(service, root_id, VERSOES_DIR)
-    vec_id = ensure_subfolder(service, root_id, VECSTORE_DIR)
-    refs_id = ensure_subfolder(service, root_id, REFERENCIAS_DIR)  # novo
+    # 1 listagem + 1 batch com as que faltarem (antes: find + create por subpasta)
+    sub = ensure_subfolders(
+        service, root_id, [TRANSCRICAO_DIR, VERSOES_DIR, VECSTORE_DIR, REFERENCIAS_DIR]
+    )
 
     return {
         "root": root_id,
-        "trans": trans_id,
-        "versions": versions_id,
-        "vec": vec_id,
-        "refs": refs_id,  # novo
+        "trans": sub[TRANSCRICAO_DIR],
+        "versions": sub[VERSOES_DIR],
+        "vec": sub[VECSTORE_DIR],
+        "refs": sub[REFERENCIAS_DIR],  # novo
     }
 
+def ensure_user_tree_cached(service) -> Dict[str, str]:
+    """
+    ensure_user_tree memorizado na sessão: a árvore não muda depois de criada, então os
+    reruns não voltam ao Drive (o re-auth do Google limpa `_drive_tree_ids`).
+    """
+    ids = st.session_state.get("_drive_tree_ids")
+    if not ids:
+        ids = st.session_state["_drive_tree_ids"] = ensure_user_tree(service)
+    return ids
+
 def build_version_filename(base_title: str, suffix: Optional[str] = None) -> str:
     """
     Gera um nome de arquivo com timestamp. Ex.: "capitulo_1_20250101_121314.txt"
@@ -42,4 +56,49 @@ def build_version_filename(base_title: str, suffix: Optional[str] = None) -> str
         return f"{base_title}_{suffix}_{ts}.txt"
     return f"{base_title}_{ts}.txt"
 
+def save_new_versions_bulk(
+    token: Dict[str, Any],
+    folder_id: str,
+    items: Sequence[Dict[str, str]],
+    vec_folder_id: Optional[str] = None,
+    existing_names: Sequence[str] = (),
+    max_workers: int = 8,
+) -> List[Tuple[str, str]]:
+    """
+    Salva vários textos de uma vez: `items` = [{"title": slug, "text": ...}]. Os .txt sobem
+    em paralelo (upload_many, dentro da cota de escrita do Drive); com `vec_folder_id`, cada
+    texto também ganha seu .faiss.zip no Vecstore, com os embeddings de todos calculados numa
+    passada só enquanto os .txt sobem. Retorna [(file_id, nome)] na ordem de `items`.
+    """
+    taken = set(existing_names)
+    names: List[str] = []
+    for i, it in enumerate(items):
+        name = build_version_filename(it["title"])
+        if name in taken:  # mesmo título no mesmo segundo (ou já existente na pasta)
+            name = build_version_filename(it["title"], suffix=f"p{i + 1}")
+        taken.add(name)
+        names.append(name)
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        fut_txt = ex.submit(
+            upload_many, token, folder_id,
+            [(n, it["text"], "text/plain") for n, it in zip(names, items)],
+            max_workers,
+        )
+        packages = []
+        if vec_folder_id:
+            from src.embeddings.vectorstore_faiss import create_faiss_indexes, faiss_index_to_zip_bytes
+
+            # nesta thread: create_faiss_indexes lê a chave da OpenAI do session_state
+            indexes = create_faiss_indexes([it["text"] for it in items])
+            packages = [
+                (f"{os.path.splitext(n)[0]}.faiss.zip", faiss_index_to_zip_bytes(ix), "application/zip")
+                for n, ix in zip(names, indexes)
+            ]
+        ids = fut_txt.result()
+
+    if packages:
+        # depois dos .txt: dois upload_many ao mesmo tempo estourariam a cota de escrita
+        upload_many(token, vec_folder_id, packages, max_workers=max_workers)
 
+    return list(zip(ids, names))
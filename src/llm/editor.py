@@ -1,7 +1,17 @@
 # src/llm/editor.py
 from __future__ import annotations
+import functools
+import hashlib
+import io
+import json
+import os
+import tempfile
 from langchain_openai import ChatOpenAI
-from typing import Optional
+from typing import Iterator, Optional
+
+# Edições já feitas, por blake2b(conta + texto + parâmetros): refazer a mesma edição não volta à OpenAI
+EDIT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "book_edit_cache")
+EDIT_CACHE_MAX = 32
 
 SYSTEM_EDITOR = """Você é um editor de livros tradicional.
 TAREFA: revisar o texto fornecido, mantendo o conteúdo factual e a organização original na medida do possível.
@@ -21,18 +31,31 @@ def build_user_prompt(
     notes: Optional[str] = None,
     instructions: Optional[str] = None,
 ) -> str:
-    parts = []
-    parts.append("Configurações desejadas para a edição:")
-    parts.append(f"- Idioma/norma: {language or 'PT-BR'}")
-    if audience: parts.append(f"- Público-alvo: {audience}")
-    if tone: parts.append(f"- Tom/voz: {tone}")
-    if notes: parts.append(f"- Observações: {notes}")
-    if instructions: parts.append(f"- Instruções específicas: {instructions}")
-    parts.append("\n--- TEXTO ORIGINAL ---\n")
-    parts.append(original_text)
-    return "\n".join(parts)
+    # escreve direto num buffer: o texto original (que pode ter MBs) é copiado uma vez só
+    buf = io.StringIO()
+    w = buf.write
+    w("Configurações desejadas para a edição:\n")
+    w(f"- Idioma/norma: {language or 'PT-BR'}\n")
+    if audience: w(f"- Público-alvo: {audience}\n")
+    if tone: w(f"- Tom/voz: {tone}\n")
+    if notes: w(f"- Observações: {notes}\n")
+    if instructions: w(f"- Instruções específicas: {instructions}\n")
+    w("\n--- TEXTO ORIGINAL ---\n\n")
+    w(original_text)
+    return buf.getvalue()
 
-def edit_as_book_editor(
+@functools.lru_cache(maxsize=8)
+def _chat_client(api_key: str, model: str, temperature: float, max_tokens: int) -> ChatOpenAI:
+    # um cliente por (chave, parâmetros) no processo: reruns reaproveitam as conexões HTTP
+    return ChatOpenAI(
+        api_key=api_key,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        streaming=True,
+    )
+
+def stream_book_edit(
     api_key: str,
     original_text: str,
     audience: Optional[str],
@@ -43,13 +66,9 @@ def edit_as_book_editor(
     model: str = "gpt-4o-mini",
     temperature: float = 0.2,
     max_tokens: int = 4096,
-) -> str:
-    llm = ChatOpenAI(
-        api_key=api_key,
-        model=model,
-        temperature=temperature,
-        max_tokens=max_tokens,
-    )
+) -> Iterator[str]:
+    """Mesma edição de `edit_as_book_editor`, mas gera os pedaços conforme chegam (st.write_stream)."""
+    llm = _chat_client(api_key, model, temperature, max_tokens)
     user_prompt = build_user_prompt(
         original_text=original_text,
         audience=audience,
@@ -58,5 +77,96 @@ def edit_as_book_editor(
         notes=notes,
         instructions=instructions,
     )
-    msg = llm.invoke([("system", SYSTEM_EDITOR), ("user", user_prompt)])
-    return msg.content.strip()
+    for chunk in llm.stream([("system", SYSTEM_EDITOR), ("user", user_prompt)]):
+        if chunk.content:
+            yield chunk.content
+
+def edit_as_book_editor(
+    api_key: str,
+    original_text: str,
+    audience: Optional[str],
+    tone: Optional[str],
+    language: Optional[str],
+    notes: Optional[str],
+    instructions: Optional[str],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    max_tokens: int = 4096,
+) -> str:
+    chunks = stream_book_edit(
+        api_key, original_text, audience, tone, language, notes, instructions,
+        model=model, temperature=temperature, max_tokens=max_tokens,
+    )
+    return "".join(chunks).strip()
+
+def edit_cache_key(api_key: str, original_text: str, **params) -> str:
+    """Chave do cache: texto + parâmetros da edição, separada por conta (hash da chave, nunca a chave)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).digest())
+    h.update(original_text.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+def load_cached_edit(key: str) -> Optional[str]:
+    path = os.path.join(EDIT_CACHE_DIR, f"{key}.txt")
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    except OSError:
+        return None
+    os.utime(path)  # marca uso recente (LRU)
+    return text
+
+def save_cached_edit(key: str, text: str) -> None:
+    os.makedirs(EDIT_CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix="tmp_", dir=EDIT_CACHE_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, os.path.join(EDIT_CACHE_DIR, f"{key}.txt"))  # atômico
+    entries = [e for e in os.scandir(EDIT_CACHE_DIR) if e.name.endswith(".txt")]
+    if len(entries) > EDIT_CACHE_MAX:
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for e in entries[: len(entries) - EDIT_CACHE_MAX]:
+            try:
+                os.remove(e.path)
+            except OSError:
+                pass
+
+def stream_book_edit_cached(
+    api_key: str,
+    original_text: str,
+    audience: Optional[str],
+    tone: Optional[str],
+    language: Optional[str],
+    notes: Optional[str],
+    instructions: Optional[str],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    max_tokens: int = 4096,
+) -> Iterator[str]:
+    """
+    stream_book_edit com cache em disco: num acerto devolve o texto guardado de uma vez (sem
+    chamar o modelo); senão faz o streaming normal e guarda o texto completo no fim.
+    """
+    key = edit_cache_key(
+        api_key, original_text, audience=audience, tone=tone, language=language, notes=notes,
+        instructions=instructions, model=model, temperature=temperature, max_tokens=max_tokens,
+    )
+    cached = load_cached_edit(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for chunk in stream_book_edit(
+        api_key, original_text, audience, tone, language, notes, instructions,
+        model=model, temperature=temperature, max_tokens=max_tokens,
+    ):
+        parts.append(chunk)
+        yield chunk
+    text = "".join(parts).strip()
+    if text:
+        try:
+            save_cached_edit(key, text)
+        except OSError:
+            pass  # cache é só otimização
@@ -0,0 +1,27 @@
+# src/llm/tokens.py
+from __future__ import annotations
+
+import functools
+from typing import Tuple
+
+import tiktoken
+
+CHAT_MODEL = "gpt-4o-mini"
+
+
+@functools.lru_cache(maxsize=4)
+def get_encoding(model: str = CHAT_MODEL) -> tiktoken.Encoding:
+    """Encoding do modelo, carregado uma vez por processo."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = CHAT_MODEL) -> Tuple[str, int]:
+    """Corta `text` em `max_tokens` tokens; retorna (texto, nº de tokens)."""
+    enc = get_encoding(model)
+    toks = enc.encode(text, disallowed_special=())
+    if len(toks) <= max_tokens:
+        return text, len(toks)
+    return enc.decode(toks[:max_tokens]), max_tokens
@@ -1,10 +1,19 @@
 # src/pipelines/transcribe.py
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import os
 import re
-from io import BytesIO
-from typing import Optional, Tuple
-from unidecode import unidecode
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+import streamlit as st
+
+from src.utils.text import ascii_fold
 
 # OpenAI SDK v1
 try:
@@ -13,49 +22,207 @@ except Exception:  # fallback para pacotes antigos nomeados como openai>=1
     from openai import OpenAI  # type: ignore
 
 
+# Regexes pré-compiladas (só ASCII: depois do ascii_fold não sobra nada fora disso)
+_RE_CR = re.compile(r"\r\n?")
+_RE_SPACES = re.compile(r"[ \t]+")
+_RE_NEWLINES = re.compile(r"\n{3,}")
+_RE_WORDS = re.compile(r"[A-Za-z0-9_]+")
+_RE_DASHES = re.compile(r"-{2,}")
+
+# Limite do endpoint de transcrição (por arquivo); acima da margem, tenta reduzir com ffmpeg
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+WHISPER_SAFE_BYTES = 24 * 1024 * 1024  # folga para o envelope multipart
+_COPY_CHUNK = 1 << 20
+
+AudioSource = Union[bytes, str, "os.PathLike[str]", BinaryIO]
+
+
+def _source_size(source: AudioSource) -> int:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    pos = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(pos)
+    return size
+
+
+def _spill_to_file(source: AudioSource, dst_dir: str, filename: str) -> str:
+    """Grava bytes/stream num arquivo (em blocos de 1 MB) para o ffmpeg ler."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    path = os.path.join(dst_dir, os.path.basename(filename) or "audio")
+    with open(path, "wb") as out:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            out.write(source)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, out, _COPY_CHUNK)
+    return path
+
+
+def _downmix_16k_mono(src_path: str, dst_dir: str) -> Optional[str]:
+    """
+    Reconverte para 16 kHz mono (opus 24 kbps) — a resolução que o Whisper usa internamente;
+    corta várias vezes o tamanho de 44.1/48 kHz estéreo. None se não houver ffmpeg.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    out = os.path.join(dst_dir, "audio_16k_mono.ogg")
+    subprocess.run(
+        [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", src_path,
+         "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k", out],
+        check=True,
+    )
+    return out
+
+
 def transcribe_audio(
-    file_bytes: bytes,
-    filename: str,
+    source: AudioSource,
+    filename: Optional[str],
     openai_key: str,
     language: Optional[str] = None,
 ) -> Tuple[str, Optional[str]]:
     """
     Envia áudio para o Whisper (OpenAI) e retorna (texto, idioma_detectado).
+    `source`: bytes, caminho ou arquivo aberto; caminhos/arquivos vão em stream para o SDK,
+    sem cópia em memória (`filename` None = nome do caminho/arquivo). Acima de ~24 MB,
+    reduz para 16 kHz mono via ffmpeg (se houver).
     `language`: se None, o Whisper tenta detectar.
     """
     client = OpenAI(api_key=openai_key)
+    if filename is None:
+        filename = os.path.basename(os.fspath(source)) if isinstance(source, (str, os.PathLike)) \
+            else getattr(source, "name", None) or "audio"
+
+    with contextlib.ExitStack() as stack:
+        if _source_size(source) > WHISPER_SAFE_BYTES:
+            tmpdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="whisper_"))
+            small = _downmix_16k_mono(_spill_to_file(source, tmpdir, filename), tmpdir)
+            if small:
+                source, filename = small, os.path.basename(small)
 
-    # O SDK atual aceita file-like; usamos BytesIO
-    file_obj = BytesIO(file_bytes)
-    file_obj.name = filename  # ajuda o servidor a inferir tipo
+        # O SDK aceita (nome, bytes | arquivo): o nome ajuda o servidor a inferir o tipo
+        if isinstance(source, (str, os.PathLike)):
+            file_obj = (filename, stack.enter_context(open(source, "rb")))
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            file_obj = (filename, bytes(source))
+        else:
+            file_obj = (filename, source)
 
-    # Modelos comuns: "whisper-1" (clássico) ou "gpt-4o-transcribe" (mais novo)
-    # Mantemos "whisper-1" por compatibilidade ampla.
-    params = {
-        "model": "whisper-1",
-        "file": file_obj,
-    }
-    if language:
-        params["language"] = language
+        # Modelos comuns: "whisper-1" (clássico) ou "gpt-4o-transcribe" (mais novo)
+        # Mantemos "whisper-1" por compatibilidade ampla.
+        # response_format="text": a API devolve a transcrição crua (sem JSON nos dois sentidos).
+        # O formato json padrão também não trazia o idioma; só o verbose_json traz.
+        params = {
+            "model": "whisper-1",
+            "file": file_obj,
+            "response_format": "text",
+        }
+        if language:
+            params["language"] = language
 
-    resp = client.audio.transcriptions.create(**params)
+        resp = client.audio.transcriptions.create(**params)
 
-    # SDK retorna .text e .language dependendo do model/SDK
-    text = getattr(resp, "text", None) or getattr(resp, "text", "")
-    detected_lang = getattr(resp, "language", None)
+    text = resp if isinstance(resp, str) else (getattr(resp, "text", "") or "")
+    detected_lang = language or getattr(resp, "language", None)
 
     # limpeza leve do texto
     text = normalize_text(text)
     return text, detected_lang
 
 
+def _blake2_hex(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# Transcrição longa: janelas de 30 s (o Whisper processa o áudio em blocos de 30 s)
+SEGMENT_SECONDS = 30
+TRANSCRIBE_CONCURRENCY = 8
+
+
+def _split_segments(src_path: str, dst_dir: str, segment_seconds: int) -> List[str]:
+    """Corta em janelas de `segment_seconds` (16 kHz mono opus) com o segment muxer do ffmpeg."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg não encontrado no PATH (necessário para dividir o áudio).")
+    pattern = os.path.join(dst_dir, "seg_%04d.ogg")
+    subprocess.run(
+        [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", src_path,
+         "-f", "segment", "-segment_time", str(segment_seconds), "-reset_timestamps", "1",
+         "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k", pattern],
+        check=True,
+    )
+    return sorted(
+        os.path.join(dst_dir, n) for n in os.listdir(dst_dir)
+        if n.startswith("seg_") and n.endswith(".ogg")
+    )
+
+
+def transcribe_long(
+    source: AudioSource,
+    filename: Optional[str],
+    openai_key: str,
+    language: Optional[str] = None,
+    segment_seconds: int = SEGMENT_SECONDS,
+    max_workers: int = TRANSCRIBE_CONCURRENCY,
+) -> Tuple[str, Optional[str]]:
+    """
+    Áudio longo: divide em janelas e transcreve até `max_workers` de uma vez (cada chamada
+    à API é sequencial por arquivo). Os textos voltam na ordem das janelas.
+    """
+    filename = filename or getattr(source, "name", None) or "audio"
+    with tempfile.TemporaryDirectory(prefix="whisper_seg_") as tmpdir:
+        segs = _split_segments(_spill_to_file(source, tmpdir, filename), tmpdir, segment_seconds)
+        if not segs:
+            return "", None
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            results = list(ex.map(lambda p: transcribe_audio(p, None, openai_key, language), segs))
+
+    text = normalize_text(" ".join(t for t, _ in results if t))
+    detected_lang = next((lang for _, lang in results if lang), None)
+    return text, detected_lang
+
+
+@st.cache_data(persist="disk", show_spinner=False, max_entries=32)
+def _transcribe_cached(
+    content_key: str, account_key: str, language: Optional[str], long: bool,
+    _file_bytes: bytes, _filename: str, _openai_key: str,
+) -> Tuple[str, Optional[str]]:
+    # só content_key/account_key/language/long entram no hash ("_" fica de fora): nada de
+    # hashear MBs de áudio a cada rerun, nem guardar a chave da OpenAI na chave do cache
+    transcribe = transcribe_long if long else transcribe_audio
+    return transcribe(_file_bytes, _filename, _openai_key, language)
+
+
+def transcribe_audio_cached(
+    file_bytes: bytes,
+    filename: str,
+    openai_key: str,
+    language: Optional[str] = None,
+    long: bool = False,
+) -> Tuple[str, Optional[str]]:
+    """
+    transcribe_audio (ou transcribe_long, com `long`) com cache em disco pelo conteúdo do
+    áudio (blake2b), por conta.
+    """
+    return _transcribe_cached(
+        _blake2_hex(file_bytes), _blake2_hex(openai_key.encode("utf-8")), language, long,
+        file_bytes, filename, openai_key,
+    )
+
+
 def normalize_text(text: str) -> str:
     """Limpeza simples: espaços, linhas duplicadas, normalização básica."""
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    # \r\n e \r soltos numa passada só (e nenhuma quando não há \r, o caso do Whisper)
+    if "\r" in text:
+        text = _RE_CR.sub("\n", text)
     # remove espaços repetidos
-    text = re.sub(r"[ \t]+", " ", text)
+    text = _RE_SPACES.sub(" ", text)
     # normaliza quebras de linha múltiplas
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _RE_NEWLINES.sub("\n\n", text)
     return text.strip()
 
 
@@ -67,14 +234,14 @@ def make_slug_from_text(text: str, max_words: int = 8) -> str:
     - separa por hífens
     """
     # Pega as primeiras N palavras significativas
-    words = re.findall(r"\b\w+\b", unidecode(text))
+    words = _RE_WORDS.findall(ascii_fold(text))
     if not words:
         return ""
 
     words = words[:max_words]
     slug = "-".join(w.lower() for w in words)
     # remove traços repetidos e bordas
-    slug = re.sub(r"-{2,}", "-", slug).strip("-")
+    slug = _RE_DASHES.sub("-", slug).strip("-")
     # fallback se ficou muito curto
     if len(slug) < 3:
         slug = "documento"
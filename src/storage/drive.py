@@ -1,14 +1,20 @@
 # src/storage/drive.py
 from __future__ import annotations
 
+import functools
 import io
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 from urllib.parse import urlencode, quote as urlquote
@@ -16,6 +22,33 @@ from urllib.parse import urlencode, quote as urlquote
 AUTH_ENDPOINT = "https://accounts.google.com/o/oauth2/v2/auth"
 TOKEN_ENDPOINT = "https://oauth2.googleapis.com/token"
 GOOGLE_OAUTH_SCOPE = "https://www.googleapis.com/auth/drive.file openid email profile"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+DRIVE_BATCH_MAX = 100  # limite de sub-requests por POST no batch/drive/v3
+TRANSFER_WORKERS = 8    # downloads/uploads simultâneos em download_many/upload_many
+WRITES_PER_SECOND = 10  # cota documentada de escritas por usuário no Drive
+RESUMABLE_MIN_BYTES = 5 * 1024 * 1024  # acima disso, upload resumable
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024   # bloco do upload resumable (múltiplo de 256 KB)
+
+def _oauth_session(retry: Retry) -> requests.Session:
+    sess = requests.Session()
+    sess.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry))
+    return sess
+
+
+# Sessões HTTP compartilhadas (keep-alive) para os POSTs diretos ao endpoint de token.
+# Troca do code: o code é de uso único, então só se repete falha de conexão (pedido não enviado);
+# um 5xx/429 ou timeout de leitura não é reenviado.
+_SESSION = _oauth_session(Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.3))
+# Refresh: reenviar o mesmo refresh_token é idempotente, então o POST é repetido em 429/5xx.
+_REFRESH_SESSION = _oauth_session(
+    Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,  # devolve a última resposta; o chamador trata o status
+    )
+)
 
 
 # ---------- helpers ----------
@@ -25,9 +58,12 @@ def _assert_secrets() -> None:
         raise RuntimeError(f"Configure {', '.join(missing)} em .streamlit/secrets.toml")
 
 
+_DRIVE_ESC = str.maketrans({"\\": "\\\\", "'": "\\'"})
+
+
 def _esc_drive_str(s: str) -> str:
     """Escapa aspas e barras para a query do Drive (Apostrophe precisa de \\')."""
-    return s.replace("\\", "\\\\").replace("'", "\\'")
+    return s.translate(_DRIVE_ESC)
 
 
 # ---------- OAuth ----------
@@ -55,7 +91,7 @@ def exchange_code_for_token(code: str) -> Dict[str, Any]:
         "redirect_uri": st.secrets["GOOGLE_REDIRECT_URI"],
         "grant_type": "authorization_code",
     }
-    resp = requests.post(TOKEN_ENDPOINT, data=data, timeout=30)
+    resp = _SESSION.post(TOKEN_ENDPOINT, data=data, timeout=30)
     if resp.status_code != 200:
         raise RuntimeError(f"Falha ao obter token ({resp.status_code}): {resp.text[:300]}")
     token = resp.json()
@@ -79,7 +115,7 @@ def refresh_token_if_needed(token: Dict[str, Any]) -> Dict[str, Any]:
         "refresh_token": token["refresh_token"],
         "grant_type": "refresh_token",
     }
-    resp = requests.post(TOKEN_ENDPOINT, data=data, timeout=30)
+    resp = _REFRESH_SESSION.post(TOKEN_ENDPOINT, data=data, timeout=30)
     if resp.status_code != 200:
         return token
     newt = resp.json()
@@ -89,7 +125,21 @@ def refresh_token_if_needed(token: Dict[str, Any]) -> Dict[str, Any]:
     return token
 
 
+@functools.lru_cache(maxsize=1)
+def _drive_discovery_doc() -> Optional[str]:
+    """
+    JSON de discovery do Drive v3 (o estático do pacote), lido do disco uma vez por processo.
+    Fica como str, não dict: o build_from_document altera os `parameters` do documento no
+    próprio objeto, e builds concorrentes (workers) não podem compartilhar um dict.
+    """
+    return get_static_doc("drive", "v3") or None
+
+
 def drive_service_from_token(token: Dict[str, Any]):
+    """
+    Novo service (httplib2 próprio). O transporte não é thread-safe: threads de trabalho
+    devem chamar esta função; o script da página usa `drive_service_for_session`.
+    """
     token = refresh_token_if_needed(token)
     creds = Credentials(
         token=token.get("access_token"),
@@ -99,21 +149,57 @@ def drive_service_from_token(token: Dict[str, Any]):
         client_secret=st.secrets["GOOGLE_CLIENT_SECRET"],
         scopes=GOOGLE_OAUTH_SCOPE.split(),
     )
+    doc = _drive_discovery_doc()
+    if doc is not None:
+        return build_from_document(doc, credentials=creds)  # parse próprio por build, sem ir ao disco
     # cache_discovery=False evita tentativa de cache em disco
     return build("drive", "v3", credentials=creds, cache_discovery=False)
 
 
+def drive_service_for_session(token: Dict[str, Any]):
+    """
+    Service reaproveitado entre reruns da sessão; só reconstrói quando o access_token muda
+    (refresh). Fica no session_state (e não em cache_resource) para nunca ser compartilhado
+    entre sessões/threads.
+    """
+    token = refresh_token_if_needed(token)
+    cached = st.session_state.get("_drive_service")
+    if cached and cached[0] == token.get("access_token"):
+        return cached[1]
+    service = drive_service_from_token(token)
+    st.session_state["_drive_service"] = (token.get("access_token"), service)
+    return service
+
+
 # ---------- Drive utils ----------
-def _query_and_list(service, q: str, page_size: int = 100) -> List[Dict[str, Any]]:
+# Máscaras de campos da listagem: só o que o chamador usa (menos JSON para baixar/parsear)
+FIELDS_ID = "nextPageToken, files(id)"
+FIELDS_ID_NAME = "nextPageToken, files(id, name)"
+FIELDS_FULL = "nextPageToken, files(id, name, mimeType, modifiedTime, size, appProperties)"
+
+
+def _query_and_list(
+    service,
+    q: str,
+    page_size: int = 1000,
+    order_by: Optional[str] = None,
+    fields: str = FIELDS_ID,
+) -> List[Dict[str, Any]]:
     files: List[Dict[str, Any]] = []
     page_token = None
+    extra = {"orderBy": order_by} if order_by else {}
+    # o app só enxerga o que ele mesmo criou (escopo drive.file): restringe aos itens do
+    # usuário para o Drive não varrer os "compartilhados comigo"
+    q = f"({q}) and 'me' in owners"
     while True:
         resp = service.files().list(
             q=q,
+            corpora="user",
             spaces="drive",
-            fields="nextPageToken, files(id, name, mimeType, modifiedTime, size)",
+            fields=fields,
             pageToken=page_token,
             pageSize=page_size,
+            **extra,
         ).execute()
         files.extend(resp.get("files", []))
         page_token = resp.get("nextPageToken")
@@ -123,14 +209,14 @@ def _query_and_list(service, q: str, page_size: int = 100) -> List[Dict[str, Any
 
 
 def find_or_create_folder(service, name: str, parent_id: Optional[str] = None) -> str:
-    q = "mimeType = 'application/vnd.google-apps.folder' and trashed = false"
+    q = f"mimeType = '{FOLDER_MIME}' and trashed = false"
     q += f" and name = '{_esc_drive_str(name)}'"
     if parent_id:
         q += f" and '{parent_id}' in parents"
-    res = _query_and_list(service, q, page_size=50)
+    res = _query_and_list(service, q, fields=FIELDS_ID)
     if res:
         return res[0]["id"]
-    body = {"name": name, "mimeType": "application/vnd.google-apps.folder"}
+    body = {"name": name, "mimeType": FOLDER_MIME}
     if parent_id:
         body["parents"] = [parent_id]
     folder = service.files().create(body=body, fields="id").execute()
@@ -141,6 +227,77 @@ def ensure_subfolder(service, parent_id: str, subfolder_name: str) -> str:
     return find_or_create_folder(service, subfolder_name, parent_id=parent_id)
 
 
+class DriveBatcher:
+    """
+    Agrupa operações só de metadados (criar pasta, atualizar metadados, apagar) em POSTs
+    multipart/mixed para o batch/drive/v3 — até DRIVE_BATCH_MAX por request. Upload/download
+    de mídia não entra em batch.
+
+        with DriveBatcher(service) as b:
+            b.add(service.files().create(body=..., fields="id"), key="Versoes")
+        b.results["Versoes"]["id"]
+
+    Respostas ficam em `results` (por key); se alguma falhar, o primeiro erro é relançado.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, Exception] = {}
+        self._batch = None
+        self._pending = 0
+
+    def _callback(self, request_id: str, response: Any, exception: Optional[Exception]) -> None:
+        if exception is not None:
+            self.errors[request_id] = exception
+        else:
+            self.results[request_id] = response
+
+    def add(self, request, key: Optional[str] = None) -> str:
+        if self._batch is None:
+            self._batch = self.service.new_batch_http_request(callback=self._callback)
+        key = key or str(len(self.results) + len(self.errors) + self._pending)
+        self._batch.add(request, request_id=key)
+        self._pending += 1
+        if self._pending >= DRIVE_BATCH_MAX:
+            self.flush()
+        return key
+
+    def flush(self) -> None:
+        batch, self._batch, self._pending = self._batch, None, 0
+        if batch is not None:
+            batch.execute()
+        if self.errors:
+            raise next(iter(self.errors.values()))
+
+    def __enter__(self) -> "DriveBatcher":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+def ensure_subfolders(service, parent_id: str, names: List[str]) -> Dict[str, str]:
+    """
+    Garante várias subpastas de uma vez: 1 listagem das pastas do pai + 1 batch com as que
+    faltam (em vez de um find + create por nome).
+    """
+    q = f"mimeType = '{FOLDER_MIME}' and trashed = false and '{parent_id}' in parents"
+    found: Dict[str, str] = {}
+    for f in _query_and_list(service, q, fields=FIELDS_ID_NAME):
+        found.setdefault(f["name"], f["id"])
+    missing = [n for n in dict.fromkeys(names) if n not in found]
+    if missing:
+        with DriveBatcher(service) as b:
+            for name in missing:
+                body = {"name": name, "mimeType": FOLDER_MIME, "parents": [parent_id]}
+                b.add(service.files().create(body=body, fields="id"), key=name)
+        found.update({name: b.results[name]["id"] for name in missing})
+    return {n: found[n] for n in names}
+
+
 def list_files_in_folder(
     service,
     folder_id: str,
@@ -152,23 +309,66 @@ def list_files_in_folder(
         q += f" and mimeType = '{_esc_drive_str(mime_type)}'"
     if name_equals:
         q += f" and name = '{_esc_drive_str(name_equals)}'"
-    return _query_and_list(service, q, page_size=100)
+    return _query_and_list(service, q, fields=FIELDS_FULL)
 
 
 def list_files_md(service, folder_id: str, extensions: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-    files = list_files_in_folder(service, folder_id)
+    # pastas ficam de fora e a ordenação (mais recente primeiro) já vem do Drive
+    q = f"trashed = false and '{folder_id}' in parents and mimeType != '{FOLDER_MIME}'"
+    files = _query_and_list(service, q, order_by="modifiedTime desc", fields=FIELDS_FULL)
     if extensions:
-        exts = {e.lower() for e in extensions}
-        files = [f for f in files if any(f["name"].lower().endswith(x) for x in exts)]
-    files.sort(key=lambda x: x.get("modifiedTime", ""), reverse=True)
+        # `name contains` do Drive casa por prefixo de termo, não sufixo: extensão só aqui
+        exts = tuple({e.lower() for e in extensions})
+        files = [f for f in files if f["name"].lower().endswith(exts)]
     return files
 
 
-def upload_text(service, folder_id: str, filename: str, text: str) -> str:
-    media = MediaIoBaseUpload(io.BytesIO(text.encode("utf-8")), mimetype="text/plain", resumable=False)
-    body = {"name": filename, "parents": [folder_id]}
-    file = service.files().create(body=body, media_body=media, fields="id").execute()
-    return file["id"]
+@st.cache_data(show_spinner=False, ttl=60, max_entries=64)
+def _list_files_md_cached(folder_id: str, exts: Optional[tuple], _service) -> List[Dict[str, Any]]:
+    return list_files_md(_service, folder_id, extensions=list(exts) if exts else None)
+
+
+def list_files_md_cached(service, folder_id: str, extensions: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """list_files_md com cache curto (60 s) por pasta: reruns de widgets não re-listam o Drive."""
+    return _list_files_md_cached(folder_id, tuple(extensions) if extensions else None, service)
+
+
+def clear_listing_cache() -> None:
+    """Chamar depois de gravar na pasta, para a próxima listagem já mostrar o arquivo novo."""
+    _list_files_md_cached.clear()
+
+
+def _get_meta(service, file_id: str) -> str:
+    return service.files().get(fileId=file_id, fields="modifiedTime").execute().get("modifiedTime", "")
+
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def _download_text_cached(file_id: str, modified_time: str, _service) -> str:
+    # modified_time entra na chave: arquivo alterado no Drive = nova entrada
+    return download_text(_service, file_id)
+
+
+def download_text_cached(service, file_id: str, modified_time: Optional[str] = None) -> str:
+    """
+    download_text com cache por (file_id, modifiedTime). Sem `modified_time` (p.ex. vindo da
+    listagem), faz só um GET de metadados antes.
+    """
+    return _download_text_cached(file_id, modified_time or _get_meta(service, file_id), service)
+
+
+def upload_text(
+    service,
+    folder_id: str,
+    filename: str,
+    text: str,
+    app_properties: Optional[Dict[str, str]] = None,
+) -> str:
+    # metadados + conteúdo num único multipart (uploadType=media + PATCH seriam 2 round-trips);
+    # textos grandes seguem o caminho resumable do upload_binary
+    return upload_binary(
+        service, folder_id, filename, text.encode("utf-8"),
+        mimetype="text/plain", app_properties=app_properties,
+    )
 
 
 def download_text(service, file_id: str) -> str:
@@ -181,10 +381,40 @@ def download_text(service, file_id: str) -> str:
     return buf.getvalue().decode("utf-8", errors="replace")
 
 
-def upload_binary(service, folder_id: str, filename: str, data: bytes, mimetype: str = "application/octet-stream") -> str:
-    media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, resumable=False)
-    body = {"name": filename, "parents": [folder_id]}
-    file = service.files().create(body=body, media_body=media, fields="id").execute()
+def _media_for(data: bytes, mimetype: str) -> MediaIoBaseUpload:
+    # acima de RESUMABLE_MIN_BYTES: upload resumable em blocos de UPLOAD_CHUNK_BYTES
+    # (retoma após falhas de rede); abaixo, um POST só (resumable custa 1 round-trip a mais)
+    resumable = len(data) > RESUMABLE_MIN_BYTES
+    return MediaIoBaseUpload(
+        io.BytesIO(data),
+        mimetype=mimetype,
+        chunksize=UPLOAD_CHUNK_BYTES,
+        resumable=resumable,
+    )
+
+
+def _execute_upload(request) -> Dict[str, Any]:
+    if not request.resumable:
+        return request.execute()
+    resp = None
+    while resp is None:
+        _, resp = request.next_chunk(num_retries=3)
+    return resp
+
+
+def upload_binary(
+    service,
+    folder_id: str,
+    filename: str,
+    data: bytes,
+    mimetype: str = "application/octet-stream",
+    app_properties: Optional[Dict[str, str]] = None,
+) -> str:
+    media = _media_for(data, mimetype)
+    body: Dict[str, Any] = {"name": filename, "parents": [folder_id]}
+    if app_properties:
+        body["appProperties"] = app_properties
+    file = _execute_upload(service.files().create(body=body, media_body=media, fields="id"))
     return file["id"]
 
 
@@ -198,9 +428,16 @@ def download_binary(service, file_id: str) -> bytes:
     return buf.getvalue()
 
 
-def update_file_contents(service, file_id: str, data: bytes, mimetype: str = "application/octet-stream") -> None:
-    media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, resumable=False)
-    service.files().update(fileId=file_id, media_body=media).execute()
+def update_file_contents(
+    service,
+    file_id: str,
+    data: bytes,
+    mimetype: str = "application/octet-stream",
+    app_properties: Optional[Dict[str, str]] = None,
+) -> None:
+    media = _media_for(data, mimetype)
+    body = {"appProperties": app_properties} if app_properties else None
+    _execute_upload(service.files().update(fileId=file_id, body=body, media_body=media))
 
 
 def safe_delete(service, file_id: str) -> None:
@@ -212,3 +449,72 @@ def safe_delete(service, file_id: str) -> None:
             return
         raise
 
+
+# ---------- Transferências em paralelo ----------
+class _RateLimiter:
+    """Espaça as chamadas em no máximo `per_second` por segundo (entre todas as threads)."""
+
+    def __init__(self, per_second: float):
+        self._interval = 1.0 / per_second
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self._interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def thread_service_getter(token: Dict[str, Any]):
+    """
+    Devolve get() -> service da thread atual, para workers de ThreadPoolExecutor:
+    o httplib2 do service não é thread-safe, então cada worker monta o seu.
+    """
+    local = threading.local()
+
+    def get():
+        svc = getattr(local, "service", None)
+        if svc is None:
+            svc = local.service = drive_service_from_token(token)
+        return svc
+
+    return get
+
+
+def download_many(
+    token: Dict[str, Any],
+    file_ids: Sequence[str],
+    binary: bool = False,
+    max_workers: int = TRANSFER_WORKERS,
+) -> List[Union[str, bytes]]:
+    """Baixa vários arquivos em paralelo; resultados na mesma ordem de `file_ids`."""
+    get_service = thread_service_getter(token)
+    fetch = download_binary if binary else download_text
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(lambda fid: fetch(get_service(), fid), file_ids))
+
+
+def upload_many(
+    token: Dict[str, Any],
+    folder_id: str,
+    items: Sequence[Tuple[str, Union[str, bytes], str]],
+    max_workers: int = TRANSFER_WORKERS,
+) -> List[str]:
+    """
+    Sobe vários arquivos (nome, conteúdo, mimetype) em paralelo, respeitando
+    WRITES_PER_SECOND. Texto (str) vai como UTF-8. Retorna os IDs na ordem de `items`.
+    """
+    get_service = thread_service_getter(token)
+    limiter = _RateLimiter(WRITES_PER_SECOND)
+
+    def _one(item: Tuple[str, Union[str, bytes], str]) -> str:
+        name, content, mimetype = item
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        limiter.wait()
+        return upload_binary(get_service(), folder_id, name, data, mimetype=mimetype)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(_one, items))
@@ -1,10 +1,42 @@
+import functools
 import re
-from unidecode import unidecode
+import unicodedata
+
+# Invisíveis (zero-width/BOM) + quebras: removidos numa única passada do translate
+_STRIP = str.maketrans("", "", "\r\n\u200b\u200c\u200d\ufeff")
+# Após ascii_fold+lower só sobra ASCII: mantém [a-z0-9] e " -_."
+_RE_NONSLUG = re.compile(r"[^a-z0-9 \-_.]+")
+
+# slugify: entrada já passou pelo ascii_fold, então classes ASCII bastam
+_RE_SLUG_DROP = re.compile(r"[^a-z0-9_\s-]", re.ASCII)
+_RE_SLUG_SEP = re.compile(r"[\s_-]+", re.ASCII)
+
+# Depois do NFKD, só ASCII + acentos combinantes = o encode("ascii", "ignore") não perde letras
+_RE_NOT_NFKD_FOLDABLE = re.compile(r"[^\x00-\x7f\u0300-\u036f]")
+
+def ascii_fold(s: str) -> str:
+    """
+    Remove acentos: ASCII passa direto; acentos latinos via NFKD (C, bem mais rápido que o
+    unidecode); o resto (ß, ø, travessões, outros alfabetos) cai no unidecode.
+    """
+    if s.isascii():
+        return s
+    nfkd = unicodedata.normalize("NFKD", s)
+    if _RE_NOT_NFKD_FOLDABLE.search(nfkd) is None:
+        return nfkd.encode("ascii", "ignore").decode("ascii")
+    from unidecode import unidecode  # import tardio: só para os casos exóticos
+
+    return unidecode(s)
+
+@functools.lru_cache(maxsize=1024)
+def _ascii_lower(s: str) -> str:
+    # títulos se repetem entre versões
+    return ascii_fold(s).lower()
 
 def slugify(text: str, max_len: int = 80) -> str:
-    text = unidecode(text).lower()
-    text = re.sub(r"[^\w\s-]", "", text)
-    text = re.sub(r"[\s_-]+", "-", text).strip("-")
+    text = ascii_fold(text).lower()
+    text = _RE_SLUG_DROP.sub("", text)
+    text = _RE_SLUG_SEP.sub("-", text).strip("-")
     return text[:max_len].rstrip("-")
 
 def safe_basename_from_filename(name: str) -> str:
@@ -17,3 +49,13 @@ def build_transcript_filename(title: str, date_utc: str, extra_kw: str | None =
     if extra_kw:
         parts.append(slugify(extra_kw, max_len=30))
     return "-".join([p for p in parts if p]) + ".md"
+
+def _line_slug(line: str) -> str:
+    base = _ascii_lower(line.translate(_STRIP).strip())
+    return _RE_NONSLUG.sub("", base).strip().replace(" ", "_")
+
+def first_line_slug(text: str, fallback: str = "documento") -> str:
+    """Slug (até 60 chars) da primeira linha do texto; usa `fallback` se não sobrar nada."""
+    line = (text or "").strip().split("\n", 1)[0]
+    slug = _line_slug(line) or _line_slug(fallback)
+    return slug[:60] or fallback
@@ -0,0 +1,73 @@
+# tests/test_drive_batch.py
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("googleapiclient")
+
+from src.storage import drive  # noqa: E402
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service, self.callback, self.requests = service, callback, []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.executed.append([rid for rid, _ in self.requests])
+        for rid, req in self.requests:
+            if req.get("fail"):
+                self.callback(rid, None, RuntimeError(f"falhou {rid}"))
+            else:
+                self.callback(rid, {"id": f"id-{req['body']['name']}"}, None)
+
+
+class FakeService:
+    def __init__(self):
+        self.executed = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def files(self):
+        return self
+
+    def create(self, body, fields):
+        return {"body": body, "fields": fields}
+
+
+def test_batcher_flushes_every_drive_batch_max(monkeypatch):
+    monkeypatch.setattr(drive, "DRIVE_BATCH_MAX", 2)
+    svc = FakeService()
+    with drive.DriveBatcher(svc) as b:
+        for n in "abcde":
+            b.add(svc.create(body={"name": n}, fields="id"), key=n)
+
+    assert svc.executed == [["a", "b"], ["c", "d"], ["e"]]
+    assert b.results["e"] == {"id": "id-e"}
+
+
+def test_batcher_reraises_first_error():
+    svc = FakeService()
+    with pytest.raises(RuntimeError, match="falhou x"):
+        with drive.DriveBatcher(svc) as b:
+            b.add({"fail": True}, key="x")
+
+
+def test_ensure_subfolders_creates_only_missing_in_one_batch(monkeypatch):
+    svc = FakeService()
+    monkeypatch.setattr(drive, "_query_and_list", lambda service, q, **kw: [{"id": "v0", "name": "Versoes"}])
+
+    ids = drive.ensure_subfolders(svc, "root", ["Transcricoes", "Versoes", "Vecstore", "Transcricoes"])
+
+    assert svc.executed == [["Transcricoes", "Vecstore"]]
+    assert ids == {"Transcricoes": "id-Transcricoes", "Versoes": "v0", "Vecstore": "id-Vecstore"}
+
+
+def test_ensure_subfolders_without_missing_skips_batch(monkeypatch):
+    svc = FakeService()
+    monkeypatch.setattr(drive, "_query_and_list", lambda service, q, **kw: [{"id": "v0", "name": "Versoes"}])
+
+    assert drive.ensure_subfolders(svc, "root", ["Versoes"]) == {"Versoes": "v0"}
+    assert svc.executed == []
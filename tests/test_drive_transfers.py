@@ -0,0 +1,73 @@
+# tests/test_drive_transfers.py
+import threading
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("googleapiclient")
+pytest.importorskip("requests")
+
+from src.storage import drive  # noqa: E402
+
+TOKEN = {"access_token": "t", "refresh_token": "r"}
+
+
+@pytest.fixture
+def services(monkeypatch):
+    """Um service falso por chamada a drive_service_from_token (registra a thread dona)."""
+    built = []
+
+    def fake_service(token):
+        svc = {"thread": threading.get_ident()}
+        built.append(svc)
+        return svc
+
+    monkeypatch.setattr(drive, "drive_service_from_token", fake_service)
+    return built
+
+
+def test_download_many_keeps_order_and_one_service_per_thread(monkeypatch, services):
+    def fake_download(service, fid):
+        assert service["thread"] == threading.get_ident()  # nunca compartilhado entre threads
+        return f"conteudo-{fid}"
+
+    monkeypatch.setattr(drive, "download_text", fake_download)
+    ids = [str(i) for i in range(20)]
+
+    out = drive.download_many(TOKEN, ids, max_workers=4)
+
+    assert out == [f"conteudo-{i}" for i in ids]
+    assert 1 <= len(services) <= 4
+
+
+def test_upload_many_encodes_text_and_returns_ids_in_order(monkeypatch, services):
+    seen = []
+
+    def fake_upload(service, folder_id, name, data, mimetype="application/octet-stream", **kw):
+        seen.append((folder_id, name, data, mimetype))
+        return f"id-{name}"
+
+    monkeypatch.setattr(drive, "upload_binary", fake_upload)
+    monkeypatch.setattr(drive, "WRITES_PER_SECOND", 1000)
+    items = [("a.txt", "olá", "text/plain"), ("b.zip", b"\x00\x01", "application/zip")]
+
+    ids = drive.upload_many(TOKEN, "pasta", items)
+
+    assert ids == ["id-a.txt", "id-b.zip"]
+    assert sorted(seen) == [
+        ("pasta", "a.txt", "olá".encode("utf-8"), "text/plain"),
+        ("pasta", "b.zip", b"\x00\x01", "application/zip"),
+    ]
+
+
+def test_rate_limiter_spaces_calls(monkeypatch):
+    clock = {"now": 100.0}
+    slept = []
+    monkeypatch.setattr(drive.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(drive.time, "sleep", slept.append)
+
+    limiter = drive._RateLimiter(10)
+    for _ in range(3):
+        limiter.wait()
+
+    assert slept == pytest.approx([0.1, 0.2])
@@ -0,0 +1,47 @@
+# tests/test_editor.py
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from src.llm import editor  # noqa: E402
+
+ARGS = dict(audience=None, tone=None, language="PT-BR", notes=None, instructions="tom leve")
+
+
+@pytest.fixture
+def fake_llm(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_stream(api_key, text, *args, **kwargs):
+        calls.append(text)
+        yield "Texto "
+        yield "editado. "
+
+    monkeypatch.setattr(editor, "stream_book_edit", fake_stream)
+    monkeypatch.setattr(editor, "EDIT_CACHE_DIR", str(tmp_path))
+    return calls
+
+
+def test_second_identical_edit_comes_from_cache(fake_llm):
+    first = "".join(editor.stream_book_edit_cached("sk-a", "original", **ARGS))
+    second = list(editor.stream_book_edit_cached("sk-a", "original", **ARGS))
+
+    assert first == "Texto editado. "
+    assert second == ["Texto editado."]  # texto guardado, de uma vez
+    assert fake_llm == ["original"]
+
+
+def test_cache_key_depends_on_params_and_account(fake_llm):
+    "".join(editor.stream_book_edit_cached("sk-a", "original", **ARGS))
+    "".join(editor.stream_book_edit_cached("sk-a", "original", **{**ARGS, "instructions": "formal"}))
+    "".join(editor.stream_book_edit_cached("sk-b", "original", **ARGS))
+
+    assert len(fake_llm) == 3
+
+
+def test_cache_keeps_at_most_edit_cache_max(fake_llm, monkeypatch, tmp_path):
+    monkeypatch.setattr(editor, "EDIT_CACHE_MAX", 2)
+    for i in range(4):
+        "".join(editor.stream_book_edit_cached("sk-a", f"texto {i}", **ARGS))
+
+    assert len(list(tmp_path.glob("*.txt"))) == 2
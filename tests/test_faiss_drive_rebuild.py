@@ -0,0 +1,80 @@
+# tests/test_faiss_drive_rebuild.py
+import itertools
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("googleapiclient")
+pytest.importorskip("streamlit")
+
+from langchain_community.embeddings import FakeEmbeddings  # noqa: E402
+
+from src.embeddings import faiss_drive as fd  # noqa: E402
+
+TOKEN = {"access_token": "t", "refresh_token": "r"}
+
+
+@pytest.fixture
+def drive(monkeypatch):
+    """Drive em memória: {nome: (bytes, modifiedTime)}; o id do arquivo é o próprio nome."""
+    files = {}
+    clock = itertools.count(1)
+
+    def put(token, parent_id, name, data, mime="application/zip"):
+        files[name] = (data, f"2025-01-01T00:00:{next(clock):02d}Z")
+        return name
+
+    def get(token, parent_id, name):
+        return files[name][0] if name in files else None
+
+    def list_md(service, parent_id, extensions=None):
+        exts = tuple(extensions or ())
+        return [
+            {"id": n, "name": n, "modifiedTime": mt}
+            for n, (_, mt) in files.items()
+            if not exts or n.endswith(exts)
+        ]
+
+    emb = FakeEmbeddings(size=8)
+    monkeypatch.setattr(fd, "_service", lambda token: None)
+    monkeypatch.setattr(fd, "_faiss_folder_id", lambda token: "faiss")
+    monkeypatch.setattr(fd, "_get_embeddings", lambda key: emb)
+    monkeypatch.setattr(fd, "_put_file_bytes", put)
+    monkeypatch.setattr(fd, "_get_file_bytes", get)
+    monkeypatch.setattr(fd, "list_files_md", list_md)
+    monkeypatch.setattr(fd, "download_binary", lambda service, fid: files[fid][0])
+    return files
+
+
+def _global_contents():
+    vs, loaded = fd._load_or_create_index(TOKEN, fd.GLOBAL_INDEX_BASENAME, fd._get_embeddings(None))
+    assert loaded
+    assert vs.index.ntotal == len(vs.index_to_docstore_id)
+    return sorted(d.page_content for d in vs.docstore._dict.values())
+
+
+def test_incremental_rebuild_after_doc_change(drive):
+    fd.upsert_texts_to_drive_index(TOKEN, "docA", ["a1", "a2"])
+    fd.upsert_texts_to_drive_index(TOKEN, "docB", ["b1"])
+    fd.rebuild_global_from_all_docs(TOKEN, full=True)
+    assert _global_contents() == ["a1", "a2", "b1"]
+
+    fd.upsert_texts_to_drive_index(TOKEN, "docA", ["a3"])
+    out = fd.rebuild_global_from_all_docs(TOKEN)
+
+    assert out["updated"] == 1
+    assert _global_contents() == ["a1", "a2", "a3", "b1"]
+
+
+def test_incremental_rebuild_drops_deleted_doc(drive):
+    fd.upsert_texts_to_drive_index(TOKEN, "docA", ["a1"])
+    fd.upsert_texts_to_drive_index(TOKEN, "docB", ["b1"])
+    fd.rebuild_global_from_all_docs(TOKEN, full=True)
+
+    del drive["docB.faiss.zip"]
+    out = fd.rebuild_global_from_all_docs(TOKEN)
+
+    assert (out["updated"], out["removed"]) == (0, 1)
+    assert _global_contents() == ["a1"]
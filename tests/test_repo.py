@@ -0,0 +1,57 @@
+# tests/test_repo.py
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("googleapiclient")
+
+from src.knowledge import repo  # noqa: E402
+
+TOKEN = {"access_token": "t", "refresh_token": "r"}
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    calls = []
+
+    def fake_upload_many(token, folder_id, items, max_workers=8):
+        calls.append((folder_id, list(items)))
+        return [f"{folder_id}:{name}" for name, _, _ in items]
+
+    monkeypatch.setattr(repo, "upload_many", fake_upload_many)
+    monkeypatch.setattr(repo, "build_version_filename",
+                        lambda title, suffix=None: f"{title}_{suffix}.txt" if suffix else f"{title}.txt")
+    return calls
+
+
+def test_bulk_names_are_unique_and_ids_follow_items(uploads):
+    items = [{"title": "cap", "text": "um"}, {"title": "cap", "text": "dois"}, {"title": "outro", "text": "três"}]
+
+    saved = repo.save_new_versions_bulk(TOKEN, "versoes", items, existing_names=["outro.txt"])
+
+    assert saved == [
+        ("versoes:cap.txt", "cap.txt"),
+        ("versoes:cap_p2.txt", "cap_p2.txt"),
+        ("versoes:outro_p3.txt", "outro_p3.txt"),
+    ]
+    assert uploads == [("versoes", [
+        ("cap.txt", "um", "text/plain"),
+        ("cap_p2.txt", "dois", "text/plain"),
+        ("outro_p3.txt", "três", "text/plain"),
+    ])]
+
+
+def test_bulk_indexes_all_texts_in_one_pass(monkeypatch, uploads):
+    vf = pytest.importorskip("src.embeddings.vectorstore_faiss")
+    batches = []
+    monkeypatch.setattr(vf, "create_faiss_indexes", lambda texts: batches.append(texts) or list(texts))
+    monkeypatch.setattr(vf, "faiss_index_to_zip_bytes", lambda ix: f"zip:{ix}".encode())
+    items = [{"title": "a", "text": "ta"}, {"title": "b", "text": "tb"}]
+
+    repo.save_new_versions_bulk(TOKEN, "refs", items, vec_folder_id="vec")
+
+    assert batches == [["ta", "tb"]]  # embeddings de todos juntos, não um por texto
+    assert [folder for folder, _ in uploads] == ["refs", "vec"]  # pacotes só depois dos .txt
+    assert uploads[1][1] == [
+        ("a.faiss.zip", b"zip:ta", "application/zip"),
+        ("b.faiss.zip", b"zip:tb", "application/zip"),
+    ]
@@ -0,0 +1,40 @@
+# tests/test_text.py
+import pytest
+
+from src.utils.text import ascii_fold, first_line_slug, slugify
+
+
+@pytest.mark.parametrize(
+    "raw, folded",
+    [
+        ("capitulo 1", "capitulo 1"),          # ASCII passa direto
+        ("Capítulo Ação", "Capitulo Acao"),    # acentos latinos via NFKD
+        ("ÀÉÎÕÜ ç", "AEIOU c"),
+    ],
+)
+def test_ascii_fold_latin(raw, folded):
+    assert ascii_fold(raw) == folded
+
+
+def test_ascii_fold_exotic_falls_back_to_unidecode():
+    pytest.importorskip("unidecode")
+    assert ascii_fold("Straße — ø") == "Strasse -- o"
+
+
+def test_first_line_slug_uses_first_line_only():
+    assert first_line_slug("Capítulo 1: O Início\nresto do texto") == "capitulo_1_o_inicio"
+
+
+def test_first_line_slug_strips_invisibles_and_blank_lead():
+    assert first_line_slug("\n\n  \ufeffTítulo\u200b Novo  \r\nmais") == "titulo_novo"
+
+
+def test_first_line_slug_fallback_and_limit():
+    assert first_line_slug("", "versao") == "versao"
+    assert first_line_slug("!!!", "Meu Doc") == "meu_doc"
+    assert len(first_line_slug("a" * 200)) == 60
+
+
+def test_slugify():
+    assert slugify("  Olá, Mundo -- _teste_ ") == "ola-mundo-teste"
+    assert slugify("x" * 100, max_len=10) == "x" * 10
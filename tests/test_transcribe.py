@@ -0,0 +1,29 @@
+# tests/test_transcribe.py
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("openai")
+
+from src.pipelines.transcribe import make_slug_from_text, normalize_text  # noqa: E402
+
+
+def test_normalize_text_line_endings_spaces_and_blank_lines():
+    raw = "  a  \t b\r\nc\r\n\r\n\r\n\r\nd\re  "
+    assert normalize_text(raw) == "a b\nc\n\nd\ne"
+
+
+def test_normalize_text_without_cr_is_untouched_apart_from_spacing():
+    assert normalize_text("linha um\n\nlinha  dois") == "linha um\n\nlinha dois"
+
+
+@pytest.mark.parametrize(
+    "text, kwargs, slug",
+    [
+        ("Capítulo 1: A Ação!", {}, "capitulo-1-a-acao"),
+        ("Capítulo 1: A Ação!", {"max_words": 2}, "capitulo-1"),
+        ("!!!", {}, ""),
+        ("a", {}, "documento"),  # curto demais
+    ],
+)
+def test_make_slug_from_text(text, kwargs, slug):
+    assert make_slug_from_text(text, **kwargs) == slug
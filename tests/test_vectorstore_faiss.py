@@ -0,0 +1,151 @@
+# tests/test_vectorstore_faiss.py
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("langchain_text_splitters")
+pytest.importorskip("streamlit")
+
+from langchain_community.embeddings import FakeEmbeddings  # noqa: E402
+from langchain_community.vectorstores import FAISS  # noqa: E402
+
+from src.embeddings import vectorstore_faiss as vf  # noqa: E402
+
+EMB = FakeEmbeddings(size=8)
+
+
+def _store(texts):
+    # mesmo caminho dos pacotes legados/bootstrap: FAISS.from_texts -> IndexFlatL2
+    return FAISS.from_texts(texts, EMB, metadatas=[{"t": t} for t in texts])
+
+
+def test_flattened_quantized_package_merges_into_legacy(monkeypatch):
+    monkeypatch.setattr(vf, "EMBEDDING_PRECISION", "int8")
+    legacy = _store(["a1", "a2"])
+    pkg = vf.quantize_faiss_index(_store(["b1"]))
+    assert isinstance(pkg.index, faiss.IndexScalarQuantizer)
+
+    loaded = vf.load_faiss_index_from_zip_bytes(vf.faiss_index_to_zip_bytes(pkg), EMB)
+    flat = vf.to_flat_faiss_index(loaded)
+    assert type(flat.index) is type(legacy.index)
+
+    legacy.merge_from(flat)
+    assert legacy.index.ntotal == len(legacy.index_to_docstore_id) == 3
+    assert sorted(d.page_content for d in legacy.docstore._dict.values()) == ["a1", "a2", "b1"]
+
+
+def test_to_flat_keeps_inner_product_metric():
+    sq = faiss.IndexScalarQuantizer(8, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    store = _store(["x"])
+    xb = store.index.reconstruct_n(0, 1)
+    sq.train(xb)
+    sq.add(xb)
+    flat = vf.to_flat_faiss_index(vf._with_index(store, sq))
+    assert isinstance(flat.index, faiss.IndexFlatIP)
+    assert flat.index.ntotal == 1
+
+
+def test_to_flat_returns_legacy_flat_untouched():
+    store = _store(["x"])
+    assert vf.to_flat_faiss_index(store) is store
+
+
+def test_create_faiss_indexes_one_index_per_text(monkeypatch):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    calls = []
+
+    class CountingEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            calls.append(len(texts))
+            return super().embed_documents(texts)
+
+    emb = CountingEmbeddings(size=8)
+    monkeypatch.setattr(vf, "_ensure_api_key", lambda: "k")
+    monkeypatch.setattr(vf, "_get_embeddings", lambda key, model=vf.EMBEDDING_MODEL: emb)
+    monkeypatch.setattr(vf, "_get_splitter", lambda: RecursiveCharacterTextSplitter(chunk_size=10, chunk_overlap=0))
+    monkeypatch.setattr(vf, "EMBED_BATCH_SIZE", 2)
+
+    out = vf.create_faiss_indexes(["aaaa bbbb\n\ncccc dddd", "", "cinco"], metadata=[{"n": 0}, {"n": 1}, {"n": 2}])
+
+    assert len(out) == 3
+    assert [ix.index.ntotal for ix in out] == [2, 1, 1]  # texto vazio vira um chunk " "
+    assert sorted(d.page_content for d in out[2].docstore._dict.values()) == ["cinco"]
+    assert [d.metadata for d in out[0].docstore._dict.values()] == [{"n": 0}, {"n": 0}]
+    assert sum(calls) == 4 and max(calls) <= 2  # uma passada só, em lotes de EMBED_BATCH_SIZE
+
+
+# ---------- serialização em memória ----------
+
+@pytest.fixture
+def no_openai(monkeypatch):
+    # loaders sem `embeddings` explícito pegam a instância padrão
+    monkeypatch.setattr(vf, "_ensure_api_key", lambda: "k")
+    monkeypatch.setattr(vf, "_get_embeddings", lambda key, model=vf.EMBEDDING_MODEL: EMB)
+
+
+def _same_store(a, b):
+    assert a.index.ntotal == b.index.ntotal
+    assert a.index_to_docstore_id == b.index_to_docstore_id
+    assert {k: (d.page_content, d.metadata) for k, d in a.docstore._dict.items()} == \
+        {k: (d.page_content, d.metadata) for k, d in b.docstore._dict.items()}
+    n = a.index.ntotal
+    assert (a.index.reconstruct_n(0, n) == b.index.reconstruct_n(0, n)).all()
+
+
+@pytest.mark.parametrize("folder", ["", "faiss_index"])
+def test_zip_round_trip(folder):
+    import zipfile
+    import io
+
+    store = _store(["um", "dois"])
+    data = vf.faiss_index_to_zip_bytes(store, folder=folder)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        infos = {i.filename: i.compress_type for i in zf.infolist()}
+    prefix = f"{folder}/" if folder else ""
+    assert infos == {prefix + "index.faiss": zipfile.ZIP_STORED, prefix + "index.pkl": zipfile.ZIP_DEFLATED}
+
+    _same_store(store, vf.load_faiss_index_from_zip_bytes(data, EMB))
+
+
+def test_zip_without_index_files_is_rejected():
+    import zipfile
+    import io
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("faiss_index/index.faiss", b"")  # sem o index.pkl ao lado
+    with pytest.raises(RuntimeError):
+        vf.load_faiss_index_from_zip_bytes(buf.getvalue(), EMB)
+
+
+def test_tar_round_trip(no_openai):
+    store = _store(["um", "dois", "três"])
+    _same_store(store, vf.load_faiss_index_from_tar_bytes(vf.faiss_index_to_tar_bytes(store)))
+
+
+def test_faiss_from_bytes_matches_parts():
+    store = _store(["x"])
+    raw, pkl = vf._faiss_to_parts(store)
+    _same_store(store, vf.faiss_from_bytes(raw, pkl, EMB))
+
+
+def test_quantized_round_trip_then_flatten_keeps_docs(monkeypatch):
+    monkeypatch.setattr(vf, "EMBEDDING_PRECISION", "fp16")
+    store = _store(["um", "dois"])
+    q = vf.quantize_faiss_index(store)
+    assert vf.quantize_faiss_index(q) is q  # já no tipo pedido: não re-quantiza
+
+    back = vf.to_flat_faiss_index(vf.load_faiss_index_from_zip_bytes(vf.faiss_index_to_zip_bytes(q), EMB))
+    assert isinstance(back.index, faiss.IndexFlatL2)
+    assert back.index_to_docstore_id == store.index_to_docstore_id
+    diff = abs(back.index.reconstruct_n(0, 2) - store.index.reconstruct_n(0, 2)).max()
+    assert diff < 1e-2  # fp16: perda pequena
+
+
+def test_quantize_fp32_is_noop(monkeypatch):
+    monkeypatch.setattr(vf, "EMBEDDING_PRECISION", "fp32")
+    store = _store(["x"])
+    assert vf.quantize_faiss_index(store) is store